@@ -0,0 +1,204 @@
+"""End-to-end benchmark of the tutorial pipeline, using the stub FANS executable.
+
+Every stage of the tutorial is run headlessly on a temporary profile, with a
+synthetic sweep of configurable size, and the latency and throughput of each
+stage is written as JSON. The stages reuse the cells of `tutorial.py`, so the
+benchmark measures exactly what the notebook runs. For example:
+
+    python benchmarks/pipeline.py --samples 16 --grid 32 --output bench.json
+
+Since the stub solves nothing, the wall time per job of the `calculations`
+stage is the orchestration overhead of AiiDA and the tutorial, plus
+`--solve-seconds` per loading step, with up to `max_concurrent` jobs running at
+once. The sweep is then run again, and once more packed into jobs
+of two parameter sets. The exit status is 1 unless every job of the rerun was
+reused from the cache and every parameter set of the packed jobs is found in
+the results table.
+"""
+
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from types import SimpleNamespace
+
+BENCHMARKS = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS.parent))
+
+
+def setup_code(workdir, mpiprocs, poll_interval):
+    """Create a computer and a code running the stub FANS executable."""
+    from aiida.orm import Computer, InstalledCode
+
+    executable = workdir / "FANS"
+    executable.write_text(f'#!/bin/sh\nexec {sys.executable} {BENCHMARKS / "stub_fans.py"} "$@"\n')
+    executable.chmod(0o755)
+
+    computer = Computer(
+        label="benchmark",
+        hostname="localhost",
+        transport_type="core.local",
+        scheduler_type="core.direct",
+        workdir=str(workdir / "run"),
+    ).store()
+    computer.set_mpirun_command(["env"])  # the stub runs without MPI
+    computer.set_default_mpiprocs_per_machine(mpiprocs)
+    computer.set_minimum_job_poll_interval(poll_interval)
+    computer.configure(safe_interval=0.0)
+
+    return InstalledCode(
+        computer=computer,
+        filepath_executable=str(executable),
+        label="stub-fans",
+        default_calc_job_plugin="fans",
+        with_mpi=True,
+    ).store()
+
+
+def setup_microstructure(workdir, grid):
+    """Write a sphere microstructure on a grid of `grid` voxels per edge.
+
+    Returns the path of the file and the name of its dataset.
+    """
+    import h5py
+    import numpy as np
+
+    x = (np.arange(grid) + 0.5) / grid - 0.5
+    sphere = (x[:, None, None] ** 2 + x[None, :, None] ** 2 + x[None, None, :] ** 2) < 0.3 ** 2
+
+    path, datasetname = workdir / "microstructure.h5", f"/sphere/{grid}x{grid}x{grid}/ms"
+    with h5py.File(path, "w") as h5:
+        h5[datasetname] = sphere.astype(np.uint8)
+    return path, datasetname
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--samples", type=int, default=4, help="number of material_properties samples")
+    parser.add_argument("--grid", type=int, default=32, help="edge length of the microstructure grid")
+    parser.add_argument("--mpiprocs", type=int, default=1, help="MPI processes per job, which sets the concurrency")
+    parser.add_argument("--fetches", type=int, default=1000, help="number of fetch() calls")
+    parser.add_argument("--solve-seconds", type=float, default=0.0, help="stub solve time per loading step")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="minimum scheduler poll interval")
+    parser.add_argument("--output", type=Path, help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    os.environ["STUB_FANS_SECONDS"] = str(args.solve_seconds)
+    report = {"config": vars(args) | {"output": args.output and str(args.output)}, "stages": {}}
+
+    def record(name, seconds, items):
+        report["stages"][name] = {"seconds": seconds, "items": items, "per_second": items / seconds}
+
+    import marimo as mo
+    import tutorial
+    from headless import run_cell, run_helpers
+    from aiida import load_profile, orm
+    from aiida.storage.sqlite_temp import SqliteTempBackend
+
+    with TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+
+        start = perf_counter()
+        load_profile(SqliteTempBackend.create_profile("benchmark"), allow_switch=True)
+        record("profile", perf_counter() - start, 1)
+
+        code = setup_code(workdir, args.mpiprocs, args.poll_interval)
+        namespace = {
+            "mo": mo,
+            "Path": Path,
+            "load_code": orm.load_code,
+        } | {name: getattr(orm, name) for name in (
+            "ArrayData", "CalcJobNode", "Data", "Dict", "Float", "Group", "Int", "List", "QueryBuilder", "SinglefileData", "Str"
+        )}
+        run_helpers(tutorial, namespace)
+
+        inputs = orm.Group(label="inputs").store()
+        path, datasetname = setup_microstructure(workdir, args.grid)
+        namespace["register_microstructure"](path)
+
+        parameter_space, fetch = namespace["parameter_space"], namespace["fetch"]
+        namespace |= {
+            "gatekeep1": lambda: None,
+            "gatekeep2": lambda: None,
+            "parameter_space": lambda ranges, n, method, seed=None: parameter_space(ranges, args.samples, method, seed=0),
+            # the tutorial names the dataset of its 32x32x32 microstructure
+            "fetch": lambda label, value: fetch(label, datasetname if label == "ms_datasetname" else value),
+        }
+        nodes = [
+            orm.Str(datasetname, label=node.label) if node.label == "ms_datasetname" else node
+            for node in run_cell(tutorial.node_definition, namespace)["nodes"]()
+        ]
+
+        start = perf_counter()
+        namespace["store_unique"](nodes, inputs)
+        record("node_storage", perf_counter() - start, len(nodes))
+
+        start = perf_counter()
+        namespace["store_unique"](nodes, inputs)
+        record("node_storage_rerun", perf_counter() - start, len(nodes))
+
+        labelled = [(node.label, node.value) for node in nodes if isinstance(node, (orm.Str, orm.Int, orm.Float))]
+        start = perf_counter()
+        for i in range(args.fetches):
+            namespace["fetch"](*labelled[i % len(labelled)])
+        record("fetch", perf_counter() - start, args.fetches)
+
+        start = perf_counter()
+        run_cell(tutorial.parameter_definition, namespace)
+        record("parameter_definition", perf_counter() - start, namespace["material_properties_query"].count())
+
+        namespace |= {
+            "calculate_button": SimpleNamespace(value=True),
+            "fields_switch": SimpleNamespace(value=False),
+            "expire_switch": SimpleNamespace(value=False),
+            "code_settings": SimpleNamespace(value={"label": code.label}),
+            "pack_size": SimpleNamespace(value=1),
+            "recompute_switch": SimpleNamespace(value=True),
+        }
+        start = perf_counter()
+        jobs = run_cell(tutorial.calculations, namespace)["jobs"]
+        seconds = perf_counter() - start
+        record("calculations", seconds, len(jobs.finished) + len(jobs.failed))
+        report["stages"]["calculations"] |= {
+            "failed": len(jobs.failed),
+            "seconds_per_job": seconds / max(1, len(jobs.finished) + len(jobs.failed)),  # wall time
+            "max_concurrent": jobs.max_concurrent,
+        }
+
+        namespace["recompute_switch"] = SimpleNamespace(value=False)
+        start = perf_counter()
+        rerun = run_cell(tutorial.calculations, namespace)["jobs"]
+        record("calculations_rerun", perf_counter() - start, len(rerun.finished) + len(rerun.failed))
+        report["stages"]["calculations_rerun"]["cached"] = len(rerun.cached)
+
+        namespace |= {"pack_size": SimpleNamespace(value=2), "recompute_switch": SimpleNamespace(value=True)}
+        start = perf_counter()
+        packed = run_cell(tutorial.calculations, namespace)["jobs"]
+        record("calculations_packed", perf_counter() - start, len(packed.finished) + len(packed.failed))
+        report["stages"]["calculations_packed"]["parameter_sets"] = sum(map(namespace["members"], packed.finished))
+
+        start = perf_counter()
+        table = namespace["results_table"]()
+        record("result_parsing", perf_counter() - start, len(table))
+        tabulated = {(pk, member) for pk, member in zip(table["pk"], table["member"]) if member}
+
+    output = json.dumps(report, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+    if len(rerun.cached) != len(jobs.finished):     # a rerun of the same sweep must come from the cache
+        print(f"Only {len(rerun.cached)} of {len(jobs.finished)} jobs were reused from the cache.", file=sys.stderr)
+        return 1
+    if len(tabulated) != report["stages"]["calculations_packed"]["parameter_sets"]:  # and packed jobs be tabulated
+        print(f"Only {len(tabulated)} parameter sets of packed jobs are in the results table.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
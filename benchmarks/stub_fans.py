@@ -0,0 +1,95 @@
+"""A deterministic stand-in for the FANS executable, for benchmarking.
+
+Usage:
+
+    python stub_fans.py input.json results.h5
+
+The input file is read like FANS would, but rather than solving anything, a log
+in the format of FANS is written to stdout and every requested result is
+written to the results file. The residual halves every iteration until the
+tolerance, or `n_it`, is reached, and the effective stress follows from the
+volume averaged moduli. The grid follows the microstructure dataset unless the
+STUB_FANS_GRID environment variable sets its edge length, and STUB_FANS_SECONDS
+adds a fixed delay per loading step to mimic the cost of a solve.
+"""
+
+import json
+import os
+import sys
+import time
+from hashlib import sha256
+
+import h5py
+import numpy as np
+
+
+def effective_stress(config, fractions, strain):
+    """Return the stress of a linear elastic material with averaged moduli."""
+    properties = config["material_properties"]
+    bulk = np.dot(fractions, properties["bulk_modulus"])
+    shear = np.dot(fractions, properties["shear_modulus"])
+    volumetric = strain[:3].sum() / 3
+    stress = 2 * shear * strain
+    stress[:3] += 3 * (bulk - 2 * shear / 3) * volumetric
+    return stress
+
+
+def main(input_file, results_file):
+    with open(input_file) as handle:
+        config = json.load(handle)
+
+    seed = int.from_bytes(sha256(json.dumps(config, sort_keys=True).encode()).digest()[:8], "little")
+    rng = np.random.default_rng(seed)
+
+    grid = os.environ.get("STUB_FANS_GRID")
+    with h5py.File(config["ms_filename"], "r") as ms:
+        if grid is None:
+            microstructure = ms[config["ms_datasetname"]][()]
+        else:
+            phases = len(np.unique(ms[config["ms_datasetname"]][()]))
+            microstructure = rng.integers(phases, size=(int(grid),) * 3, dtype=np.uint8)
+    fractions = np.bincount(microstructure.ravel()) / microstructure.size
+    delay = float(os.environ.get("STUB_FANS_SECONDS", 0))
+
+    tolerance = config["error_parameters"]["tolerance"]
+    print(f"# Start FANS (stub) - {config['problem_type']} / {config['matmodel']}")
+    with h5py.File(results_file, "w") as results:
+        for case, path in enumerate(config["macroscale_loading"]):
+            for step, strain in enumerate(np.asarray(path, dtype=float)):
+                errors = []
+                err0 = err = 1.0
+                for it in range(config["n_it"]):
+                    errors.append(err)
+                    print(f"it {it:3d} .... err {err:16.8e} / {err / err0:8.8e}, ratio: {0.5:4.8e}, FFT time: {0.0:2.6f} sec")
+                    if err < tolerance:
+                        break
+                    err /= 2
+                time.sleep(delay)
+
+                stress = effective_stress(config, fractions, strain)
+                print(f"# Effective Stress .. ({' '.join(f'{x:+.12f}' for x in stress)}) ")
+                print(f"# Effective Strain .. ({' '.join(f'{x:+.12f}' for x in strain)}) ")
+                print()
+
+                shape = microstructure.shape
+                fields = {
+                    "stress": lambda: stress + rng.normal(scale=1e-3, size=(*shape, 6)),
+                    "strain": lambda: strain + rng.normal(scale=1e-6, size=(*shape, 6)),
+                    "displacement": lambda: rng.normal(scale=1e-6, size=(*shape, 3)),
+                    "microstructure": lambda: microstructure,
+                    "stress_average": lambda: stress,
+                    "strain_average": lambda: strain,
+                    "phase_stress_average": lambda: np.tile(stress, (len(fractions), 1)),
+                    "phase_strain_average": lambda: np.tile(strain, (len(fractions), 1)),
+                    "absolute_error": lambda: np.array(errors),
+                }
+                group = results.require_group(f"{config['ms_datasetname']}_results/load{case}/time_step{step}")
+                for name in config["results"]:
+                    if name in fields:
+                        group[name] = fields[name]()
+
+    print("# FANS (stub) complete")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,7 @@
+"""Calculations and parsers of the aiida-fans tutorial.
+
+They are defined here rather than in `tutorial.py`, so that AiiDA can load them
+again from the `process_type` of their nodes, which it needs to reuse finished
+calculations from its cache. Nothing is imported here, so that importing
+`fans_tutorial.results` doesn't import the AiiDA engine.
+"""
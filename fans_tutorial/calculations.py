@@ -0,0 +1,154 @@
+"""Calculations of the aiida-fans tutorial."""
+
+from json import dump
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+
+from aiida.common import CalcInfo, CodeInfo, CodeRunMode
+from aiida.engine import CalcJob, calcfunction
+from aiida.orm import ArrayData, Dict, Float, Int, List, SinglefileData, Str
+from aiida.plugins import CalculationFactory
+
+from fans_tutorial.results import compact_results
+
+FANSCalculation = CalculationFactory("fans")
+
+
+def retrieval_options(spec):
+    """Add the options of the retrieval policy of the tutorial to a process spec."""
+    spec.input(
+        "metadata.options.retrieve_fields", valid_type=bool, default=False,
+        help="Whether to store the full fields in the `results` output.",
+    )
+    spec.input(
+        "metadata.options.compression", valid_type=str, default="gzip",
+        help="The compression of the stored full fields, `gzip` or `lzf`.",
+    )
+    spec.input(
+        "metadata.options.field_tolerance", valid_type=float, required=False,
+        help="The relative error within which full fields are stored as float32.",
+    )
+
+
+class AveragesFANSCalculation(FANSCalculation):
+    """`FANSCalculation` storing only the scalar and averaged results.
+
+    The full fields are dropped from the `results` output by its parser, but
+    kept in the working directory of the job, unless the `retrieve_fields`
+    option is set. Then, they are compacted following the `compression` and
+    `field_tolerance` options instead.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.inputs["metadata"]["options"]["parser_name"].default = "fans_tutorial.averages"
+        retrieval_options(spec)
+        spec.exit_code(300, "ERROR_MISSING_RESULTS", message="The results were not retrieved.")
+
+
+class PackedFANSCalculation(CalcJob):
+    """Calculation job running FANS for several parameter sets in one job.
+
+    The members of the job are given by the keys of the `material_properties`
+    and `n_it` namespaces, and all other inputs are shared. FANS is run for
+    each member in turn, and the HDF5 results of each member are attached to
+    the `results` namespace under the same key. As for `FANSCalculation`, only
+    the dataset of the microstructure is staged, once for all members. The log of each member is
+    retrieved as `<key>.json.log`. Like `AveragesFANSCalculation`, only the
+    scalar and averaged results are stored, unless `retrieve_fields` is set,
+    in which case the full fields are compacted.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.input("microstructure.file", valid_type=SinglefileData)
+        spec.input("microstructure.datasetname", valid_type=Str)
+        spec.input("microstructure.L", valid_type=List)
+        spec.input("problem_type", valid_type=Str)
+        spec.input("matmodel", valid_type=Str)
+        spec.input("method", valid_type=Str)
+        spec.input("error_parameters.measure", valid_type=Str)
+        spec.input("error_parameters.type", valid_type=Str)
+        spec.input("error_parameters.tolerance", valid_type=Float)
+        spec.input("macroscale_loading", valid_type=ArrayData)
+        spec.input("results", valid_type=List)
+        spec.input_namespace("material_properties", valid_type=Dict, dynamic=True)
+        spec.input_namespace("n_it", valid_type=Int, dynamic=True)
+        spec.output_namespace("results", valid_type=SinglefileData, dynamic=True)
+        spec.inputs["metadata"]["options"]["resources"].default = {"num_machines": 1}
+        spec.inputs["metadata"]["options"]["withmpi"].default = True
+        spec.inputs["metadata"]["options"]["parser_name"].default = "fans_tutorial.packed"
+        retrieval_options(spec)
+        spec.exit_code(300, "ERROR_MISSING_RESULTS", message="The results of member {key} were not retrieved.")
+
+    def prepare_for_submission(self, folder):
+        import h5py
+
+        microstructure = self.inputs.microstructure
+        datasetname = microstructure.datasetname.value
+        with folder.open("microstructure.h5", "bw") as f_dest, h5py.File(f_dest, "w") as h5_dest:
+            with microstructure.file.open(mode="rb") as f_src, h5py.File(f_src, "r") as h5_src:
+                h5_src.copy(datasetname, h5_dest, name=datasetname)  # only the dataset of the microstructure
+
+        loading = self.inputs.macroscale_loading
+        shared = {
+            "ms_filename": "microstructure.h5",
+            "ms_datasetname": datasetname,
+            "ms_L": microstructure.L.get_list(),
+            "problem_type": self.inputs.problem_type.value,
+            "matmodel": self.inputs.matmodel.value,
+            "method": self.inputs.method.value,
+            "error_parameters": {
+                "measure": self.inputs.error_parameters.measure.value,
+                "type": self.inputs.error_parameters.type.value,
+                "tolerance": self.inputs.error_parameters.tolerance.value,
+            },
+            "macroscale_loading": [
+                loading.get_array(name).tolist()
+                for name in sorted(loading.get_arraynames(), key=lambda name: (len(name), name))
+            ],
+            "results": self.inputs.results.get_list(),
+        }
+
+        codes_info = []
+        for key, material_properties in self.inputs.material_properties.items():
+            with folder.open(f"{key}.json", "w") as handle:
+                dump(shared | {
+                    "material_properties": material_properties.get_dict(),
+                    "n_it": self.inputs.n_it[key].value,
+                }, handle, indent=4)
+
+            codeinfo = CodeInfo()
+            codeinfo.code_uuid = self.inputs.code.uuid
+            codeinfo.cmdline_params = [f"{key}.json", f"{key}.h5"]
+            codeinfo.stdout_name = f"{key}.json.log"
+            codeinfo.withmpi = self.inputs.metadata.options.withmpi
+            codes_info.append(codeinfo)
+
+        calcinfo = CalcInfo()
+        calcinfo.codes_info = codes_info
+        calcinfo.codes_run_mode = CodeRunMode.SERIAL
+        calcinfo.local_copy_list = []
+        calcinfo.provenance_exclude_list = ["microstructure.h5"]  # already stored as the microstructure input
+        calcinfo.retrieve_list = [f"{key}.json.log" for key in self.inputs.material_properties]
+        calcinfo.retrieve_temporary_list = [f"{key}.h5" for key in self.inputs.material_properties]
+        return calcinfo
+
+
+@calcfunction
+def copy_results(remote_folder, filename):
+    """Copy a results file from the working directory of a calculation, compacted."""
+    calc = remote_folder.creator
+    source = PurePosixPath(remote_folder.get_remote_path()) / filename.value
+    with TemporaryDirectory() as tmp, remote_folder.get_authinfo().get_transport() as transport:
+        if not transport.isfile(str(source)):
+            raise FileNotFoundError(f"{source} is missing on {remote_folder.computer.label}.")
+        transport.getfile(str(source), f"{tmp}/{filename.value}")
+        compact_results(
+            Path(tmp, filename.value), Path(tmp, "compact.h5"),
+            calc.get_option("compression") or "gzip", calc.get_option("field_tolerance"),
+            calc.inputs.microstructure,
+        )
+        return SinglefileData(Path(tmp, "compact.h5"), filename=filename.value)
@@ -0,0 +1,56 @@
+"""Parsers of the aiida-fans tutorial."""
+
+from pathlib import Path
+
+from aiida.engine import ExitCode
+from aiida.orm import SinglefileData
+from aiida.parsers.parser import Parser
+from aiida.plugins import ParserFactory
+
+from fans_tutorial.results import transform_results
+
+FANSParser = ParserFactory("fans")
+
+
+class AveragesFANSParser(FANSParser):
+    """Parser of `AveragesFANSCalculation`, transforming the results before storing them."""
+
+    def parse(self, **kwargs) -> ExitCode:
+        """Transform the retrieved results, then store them like the plugin's parser.
+
+        Following the options of the calculation, the full fields are dropped or
+        compacted, and the bytes saved are recorded in the `bytes_saved` extra.
+        """
+        path = Path(kwargs.get("retrieved_temporary_folder") or "") / self.node.get_option("output_filename")
+        if "retrieved_temporary_folder" not in kwargs or not path.is_file():
+            return self.exit_codes.ERROR_MISSING_RESULTS
+
+        target, saved = transform_results(path, self.node, self.node.inputs.microstructure)
+        target.replace(path)
+        self.node.base.extras.set("bytes_saved", saved)
+        self.logger.info(f"Storing the results saved {saved} bytes.")
+        return super().parse(**kwargs)
+
+
+class PackedFANSParser(Parser):
+    """Parser of `PackedFANSCalculation`, splitting the results into one output per member."""
+
+    def parse(self, **kwargs) -> ExitCode:
+        """Transform the retrieved results of each member and store them under its key.
+
+        The bytes saved by all members together are recorded in the
+        `bytes_saved` extra.
+        """
+        folder = Path(kwargs.get("retrieved_temporary_folder") or "")
+        total = 0
+        for key in self.node.inputs.material_properties:
+            path = folder / f"{key}.h5"
+            if "retrieved_temporary_folder" not in kwargs or not path.is_file():
+                return self.exit_codes.ERROR_MISSING_RESULTS.format(key=key)
+            path, saved = transform_results(path, self.node, self.node.inputs.microstructure)
+            self.out(f"results.{key}", SinglefileData(path, filename=f"{key}.h5"))
+            total += saved
+
+        self.node.base.extras.set("bytes_saved", total)
+        self.logger.info(f"Storing the results of {len(self.node.inputs.material_properties)} members saved {total} bytes.")
+        return ExitCode(0)
@@ -0,0 +1,91 @@
+"""Transforms of the HDF5 results written by FANS, applied before they are stored."""
+
+FIELDS = ("stress", "strain", "displacement", "microstructure")  # results with a value per voxel
+
+
+def reduce_results(source, target, fields=FIELDS):
+    """Copy HDF5 results without their full fields.
+
+    Every group and dataset of `source` is copied to `target` with its
+    attributes, except the datasets named in `fields`.
+    """
+    import h5py
+
+    with h5py.File(source, "r") as src, h5py.File(target, "w") as dst:
+        dst.attrs.update(src.attrs)
+
+        def copy(name, obj):
+            parent, _, base = name.rpartition("/")
+            if isinstance(obj, h5py.Group):
+                dst.require_group(name).attrs.update(obj.attrs)
+            elif base not in fields:
+                src.copy(obj, dst.require_group(parent or "/"), name=base)
+        src.visititems(copy)
+
+
+def compact_results(source, target, compression="gzip", tolerance=None, microstructure=None, fields=FIELDS):
+    """Copy HDF5 results with their full fields compacted.
+
+    The datasets named in `fields` are stored in chunks of one plane of
+    voxels, shuffled and compressed with `compression`, `"gzip"` or `"lzf"`.
+    With `tolerance`, float64 fields are stored as float32 if the largest
+    error stays within this fraction of the largest value. Given the
+    `microstructure` inputs of the calculation, the microstructure datasets
+    are replaced by attributes referring to the input file. Returns the
+    number of bytes saved.
+    """
+    from os.path import getsize
+    import h5py
+    from numpy import float32, float64
+
+    with h5py.File(source, "r") as src, h5py.File(target, "w") as dst:
+        def copy(name, obj):
+            parent, _, base = name.rpartition("/")
+            if isinstance(obj, h5py.Group):
+                dst.require_group(name).attrs.update(obj.attrs)
+                return
+            group = dst.require_group(parent or "/")
+            if base == "microstructure" and microstructure is not None:
+                group.attrs.update({
+                    "microstructure_uuid": microstructure.file.uuid,
+                    "microstructure_filename": microstructure.file.filename,
+                    "microstructure_datasetname": microstructure.datasetname.value,
+                })
+            elif base in fields and obj.ndim > 1:
+                dtype = obj.dtype
+                if tolerance is not None and dtype == float64:
+                    error = scale = 0.0
+                    for plane in obj:                 # one plane of voxels at a time
+                        error = max(error, abs(plane - plane.astype(float32)).max())
+                        scale = max(scale, abs(plane).max())
+                    dtype = float32 if error <= tolerance * scale else dtype
+                dataset = group.create_dataset(
+                    base, shape=obj.shape, dtype=dtype, chunks=(1, *obj.shape[1:]), shuffle=True,
+                    compression=compression, compression_opts=4 if compression == "gzip" else None,
+                )
+                for i, plane in enumerate(obj):
+                    dataset[i] = plane
+                dataset.attrs.update(obj.attrs)
+            else:
+                src.copy(obj, group, name=base)
+        src.visititems(copy)
+
+    return getsize(source) - getsize(target)
+
+
+def transform_results(path, calc, microstructure):
+    """Transform the retrieved results of a calculation.
+
+    Following the options of `calc`, the full fields of the HDF5 results at
+    `path` are either dropped or compacted. Returns the path of the new file
+    and the number of bytes saved.
+    """
+    target = path.with_name(f"stored_{path.name}")
+    if calc.get_option("retrieve_fields"):
+        compact_results(
+            path, target, calc.get_option("compression") or "gzip", calc.get_option("field_tolerance"),
+            microstructure,
+        )
+    else:
+        reduce_results(path, target)
+    return target, path.stat().st_size - target.stat().st_size
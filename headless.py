@@ -0,0 +1,185 @@
+"""Run the tutorial's workflow from the command line, without the marimo UI.
+
+The cells of `tutorial.py` are run in order, exactly as in the notebook, with
+the values of the buttons and forms taken from a sweep file instead. This
+suits batch jobs, where starting a UI server is pure overhead. For example:
+
+    python tutorial.py --headless --sweep sweep.yaml
+
+A summary is written as JSON once the sweep is over. The exit status is 0 if
+every calculation finished successfully and 1 otherwise.
+"""
+
+import builtins
+import json
+import sys
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+
+
+class Stopped(RuntimeError):
+    """Raised when a cell of the tutorial stops before defining its names."""
+
+
+def run_cell(cell, namespace):
+    """Run a cell of the tutorial with its references taken from `namespace`.
+
+    Printed output is sent to stderr, so stdout is left for the summary. The
+    names defined by the cell are added to `namespace` and returned.
+    """
+    refs = {name: namespace[name] for name in cell.refs if not hasattr(builtins, name)}
+    with redirect_stdout(sys.stderr):
+        output, defs = cell.run(**refs)
+    if set(cell.defs) - set(defs):
+        raise Stopped(f"The cell `{cell.name}` stopped: {getattr(output, 'text', output)}")
+    namespace.update(defs)
+    return defs
+
+
+def run_helpers(module, namespace):
+    """Run the helper cells of the appendix whose references are in `namespace`.
+
+    The helpers are run in the order of their dependencies. Those which have
+    run before are skipped, and those still missing references are returned.
+    """
+    helpers = [getattr(module, name) for name in dir(module) if name.endswith("_helper")]
+    pending = [cell for cell in helpers if not cell.defs <= namespace.keys()]
+    while ready := [cell for cell in pending if all(
+        name in namespace or hasattr(builtins, name) for name in cell.refs
+    )]:
+        for cell in ready:
+            run_cell(cell, namespace)
+            pending.remove(cell)
+    return pending
+
+
+def load_sweep(path):
+    """Read a sweep file, filling in the defaults of the notebook's widgets.
+
+    A relative `microstructure` path is taken relative to the sweep file.
+    """
+    import yaml
+
+    with open(path) as handle:
+        config = yaml.safe_load(handle) or {}
+
+    for key in ("code", "microstructure"):
+        if key not in config:
+            raise KeyError(f"The sweep file {path} does not set `{key}`.")
+
+    sampling = {"n": None, "method": None, "seed": None} | (config.get("sampling") or {})
+    return {
+        "profile": config.get("profile"),
+        "code": config["code"],
+        "microstructure": str((Path(path).parent / Path(config["microstructure"]).expanduser()).resolve()),
+        "sampling": sampling,
+        "pack_size": int(config.get("pack_size", 1)),
+        "recompute": bool(config.get("recompute", False)),
+        "keep_fields": bool(config.get("keep_fields", False)),
+        "expire_fields": bool(config.get("expire_fields", True)),
+        "autotune": bool(config.get("autotune", False)),
+        "results": config.get("results"),
+    }
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="tutorial.py", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--headless", action="store_true", help="run without the marimo UI")
+    parser.add_argument("--sweep", type=Path, required=True, help="YAML file describing the sweep")
+    parser.add_argument("--output", type=Path, help="write the JSON summary here instead of stdout")
+    args = parser.parse_args(argv)
+    config = load_sweep(args.sweep)
+
+    import marimo as mo
+    import tutorial
+    from aiida import load_profile
+
+    summary = {"sweep": str(args.sweep), "stages": {}}
+
+    def stage(name, cell, **widgets):
+        namespace.update(widgets)
+        start = perf_counter()
+        defs = run_cell(cell, namespace)
+        summary["stages"][name] = perf_counter() - start
+        return defs
+
+    namespace = {"mo": mo, "Path": Path}
+    button = SimpleNamespace(value=True)
+
+    start = perf_counter()
+    run_helpers(tutorial, namespace)
+    summary["profile"] = load_profile(config["profile"]).name  # the notebook then keeps this profile
+    summary["stages"]["profile"] = perf_counter() - start
+    stage("imports", tutorial.imports, load_profile_button=button)
+    stage("datatypes", tutorial.datatypes, load_profile_button=button)
+    stage("group", tutorial.group)
+
+    start = perf_counter()
+    if pending := run_helpers(tutorial, namespace):
+        raise Stopped(f"Unresolved references of {', '.join(cell.name for cell in pending)}.")
+    summary["stages"]["helpers"] = perf_counter() - start
+
+    stage(
+        "microstructure", tutorial.microstructure,
+        abs_path=SimpleNamespace(value=config["microstructure"]),
+        mk_microstructure_button=button,
+    )
+
+    parameter_space, sampling = namespace["parameter_space"], config["sampling"]
+    stage(
+        "node_definition", tutorial.node_definition,
+        gatekeep1=lambda: None,
+        parameter_space=lambda ranges, n, method, seed=None: parameter_space(
+            ranges, sampling["n"] or n, sampling["method"] or method,
+            seed=seed if sampling["seed"] is None else sampling["seed"],
+        ),
+    )
+    stage("node_storage", tutorial.node_storage, def_nodes_button=button)
+    stage("parameter_definition", tutorial.parameter_definition, gatekeep2=lambda: None)
+
+    code_settings = SimpleNamespace(value={"label": config["code"]})
+    if config["autotune"]:
+        defs = stage("autotune", tutorial.calibration, autotune_button=button, code_settings=code_settings)
+        summary["autotune"] = {"mpiprocs": defs["calibrated_mpiprocs"], "calibration": defs["calibration_records"]}
+
+    jobs = stage(
+        "calculations", tutorial.calculations,
+        calculate_button=button,
+        code_settings=code_settings,
+        pack_size=SimpleNamespace(value=config["pack_size"]),
+        fields_switch=SimpleNamespace(value=config["keep_fields"]),
+        expire_switch=SimpleNamespace(value=config["expire_fields"]),
+        recompute_switch=SimpleNamespace(value=config["recompute"]),
+    )["jobs"]
+    summary["calculations"] = {
+        "total": namespace["total"],
+        "finished": len(jobs.finished),
+        "parameter_sets": sum(map(namespace["members"], jobs.finished)),
+        "failed": [job.pk for job in jobs.failed],
+        "cached": len(jobs.cached),
+        "bytes_saved": sum(job.base.extras.get("bytes_saved", 0) for job in jobs.finished),
+    }
+
+    start = perf_counter()
+    table = namespace["results_table"]()
+    if config["results"] is not None:
+        import numpy as np
+
+        np.save(config["results"], table)
+    summary["stages"]["results"] = perf_counter() - start
+    summary["results"] = {"rows": len(table), "file": config["results"]}
+
+    output = json.dumps(summary, indent=4)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
+
+    return 1 if jobs.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
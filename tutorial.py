@@ -106,6 +106,7 @@ def _(mo):
                 "Last Name:",
                 "Email:",
                 "Institution:",
+                "Storage Backend:",
             ], align="start", heights="equal", gap=0.8),
             mo.vstack([
                 "{profile_name}",
@@ -113,6 +114,7 @@ def _(mo):
                 "{last_name}",
                 "{email}",
                 "{institution}",
+                "{backend}",
             ], align="start", heights="equal", gap=0.5)
         ],
         justify="center", align="stretch", gap=2.0,
@@ -122,6 +124,9 @@ def _(mo):
         last_name=mo.ui.text("Mustermann"),
         email=mo.ui.text("example@nomail.com"),
         institution=mo.ui.text("MIB"),
+        backend=mo.ui.dropdown(
+            {"SQLite": "core.sqlite_dos", "PostgreSQL + RabbitMQ": "core.psql_dos"}, value="SQLite"
+        ),
     ).form(
         show_clear_button=True, clear_button_label="Reset", bordered=True
     )
@@ -146,11 +151,25 @@ def _(mo, profile_settings):
     last_name: {profile_settings.value["last_name"]}
     email: {profile_settings.value["email"]}
     institution: {profile_settings.value["institution"]}
-    use_rabbitmq: false
     set_as_default: true
     non_interactive: true
     """
 
+    if profile_settings.value["backend"] == "core.psql_dos":
+        profile_config += \
+    rf"""database_engine: postgresql_psycopg
+    database_hostname: localhost
+    database_port: 5432
+    database_name: {profile_settings.value["profile_name"]}
+    database_username: {profile_settings.value["profile_name"]}
+    database_password: {profile_settings.value["profile_name"]}
+    use_rabbitmq: true
+    """
+    else:
+        profile_config += \
+    r"""use_rabbitmq: false
+    """
+
     with open("configure_profile.yaml", "w") as _f:
         _f.write(profile_config)
 
@@ -176,13 +195,32 @@ def _(mo, profile_settings):
     ```
     """).callout(kind="info")
 
+    _backend = "<backend>" if profile_settings.value is None else profile_settings.value["backend"]
+    _name = "<profile_name>" if profile_settings.value is None else profile_settings.value["profile_name"]
+    _backends = mo.md(rf"""
+    **Note:** _on storage backends..._
+
+    A SQLite profile keeps its database in a single file, so nothing needs to be installed. However, only one process can write to it at a time. When this notebook loads a SQLite profile, it switches the database to write-ahead logging, which lets other processes read while one writes, and makes writers wait for each other rather than fail (see [Appendix O](#appendix)). This is plenty for this tutorial.
+
+    When you move on to thousands of jobs run by several daemon workers, choose PostgreSQL instead. It needs a running PostgreSQL server with a database and user for the profile, and a RabbitMQ broker for the daemon. For a locally started PostgreSQL server, these can be created with:
+
+    ```
+    psql -h localhost -U postgres -c "CREATE USER \"{_name}\" WITH PASSWORD '{_name}'"
+    psql -h localhost -U postgres -c "CREATE DATABASE \"{_name}\" OWNER \"{_name}\""
+    ```
+
+    Alternatively, `verdi presto --use-postgres` creates the database, user, and profile in one go. You can measure how fast nodes are stored and queried in your profile in [Appendix O](#appendix).
+    """).callout(kind="info")
+
     mo.md(f"""
     To create your new profile from this file run:
 
     ```
-    verdi profile setup core.sqlite_dos --config configure_profile.yaml
+    verdi profile setup {_backend} --config configure_profile.yaml
     ```
 
+    {_backends}
+
     Hopefully, that completed successfully. Using these commands, you should see your new profile listed (alone if this is your first profile) and a report on it also:
 
     ```
@@ -213,17 +251,19 @@ def _(mo):
 
 
 @app.cell(hide_code=True)
-def _(mo):
+def _(Path, mo):
     computer_settings = mo.hstack(
         [
             mo.vstack([
                 "Computer Label:",
                 "MPI processes:",
+                "Work Directory:",
                 "Description:",
             ], align="start", heights="equal", gap=0.8),
             mo.vstack([
                 "{label}",
                 "{mpiprocs}",
+                "{work_dir}",
                 "{description}",
             ], align="start", heights="equal", gap=0.5)
         ],
@@ -231,6 +271,7 @@ def _(mo):
     ).batch(
             label=mo.ui.text("localhost"),
             mpiprocs=mo.ui.text("2"),
+            work_dir=mo.ui.text(f"{Path.cwd()}/.aiida_run", full_width=True),
             description=mo.ui.text_area("This is my local machine."),
     ).form(
         show_clear_button=True, clear_button_label="Reset", bordered=True
@@ -238,13 +279,19 @@ def _(mo):
 
     mo.vstack([
         mo.md("**Fill in the details below to generate your custom computer configuration.**"),
-        computer_settings
+        computer_settings,
+        mo.md(
+            "Every job writes its input and output files to its own folder within the work directory. "
+            "A fast local disk is best, such as the memory-backed `/dev/shm/{username}/aiida_run` "
+            "or a node-local NVMe scratch disk, rather than a network home directory. "
+            "AiiDA replaces `{username}` with your user name."
+        ).style(max_width="40rem"),
     ], align="center")
     return (computer_settings,)
 
 
 @app.cell(hide_code=True)
-def _(Path, computer_settings, mo):
+def _(computer_settings, mo):
     mo.stop(
         computer_settings.value is None,
         mo.status.spinner(title="Awaiting input above ...", remove_on_exit=False)
@@ -257,7 +304,7 @@ def _(Path, computer_settings, mo):
     transport: core.local
     scheduler: core.direct
     shebang: #!/bin/bash
-    work_dir: {Path.cwd()}/.aiida_run""" + r"""
+    work_dir: {computer_settings.value["work_dir"]}""" + r"""
     mpirun_command: mpiexec -n {tot_num_mpiprocs}""" + rf"""
     mpiprocs_per_machine: {computer_settings.value["mpiprocs"]}
     default_memory_per_machine: null
@@ -388,7 +435,7 @@ def _(code_settings, computer_settings, mo):
 
 @app.cell(hide_code=True)
 def _(code_settings, mo):
-    _note = mo.md(rf"""
+    _note = mo.md(r"""
     **Note:** _your first node..._
 
     You should also note that the code is saved by AiiDA as a node, and thus we have created our first node. Any calculation jobs we perform will be connected to this code node in the provenance graph.
@@ -553,8 +600,10 @@ def _(mo):
     {load_profile_button}
 
     ```py
-    from aiida.engine import run                  # run jobs
-    from aiida.plugins import CalculationFactory  # generates fans calculation
+    from aiida import get_profile, load_profile   # injects profile context into script
+    get_profile() or load_profile()               # unless a profile is loaded already
+    tune_storage()                                # see Appendix O
+
     from aiida.orm import (
         Group,                                    # node organisation tool
         SinglefileData,                           # \
@@ -564,28 +613,45 @@ def _(mo):
         List,                                     # |
         Dict,                                     # |
         ArrayData,                                # /
+        Data,                                     # base type of all datatypes
         CalcJobNode,                              # node type for calculation jobs
         QueryBuilder,                             # advanced query tool
         load_node,                                # basic query tool for nodes
         load_code,                                # basic query tool for codes
     )
-    from numpy import array                       # numpy array
-    from itertools import product                 # for parameter space generation
-    from random import uniform                    # for parameter space generation
-
-    from aiida import load_profile                # injects profile context into script
-    load_profile()
     ```
+
+    Only the profile and the AiiDA datatypes, which the very next cells work with, are loaded here. The AiiDA engine, the FANS plugin, NumPy, and the libraries used to sample parameters and read results are each imported by the cell that first needs them, so pressing this button takes as little time as possible. The profile is loaded once, and every later cell works with it. How long each of these imports takes on your machine can be measured in [Appendix N](#appendix).
     """)
     return (load_profile_button,)
 
 
 @app.cell(hide_code=True)
-def imports(load_profile_button, mo):
+def imports(load_profile_button, mo, tune_storage):
+    mo.stop(not load_profile_button.value)  # run on click
+
+    from time import perf_counter as _clock
+    _start = _clock()
+
+    from aiida import get_profile, load_profile   # injects profile context into script
+    _imported = _clock()
+    try:
+        _profile = get_profile() or load_profile() # keep one loaded already, e.g. by headless.py
+    except Exception:
+        mo.stop(True, output=mo.md("**Your profile failed to load properly!**").style(text_align="center").callout(kind="danger"))
+    tune_storage()                                # see Appendix O
+
+    startup = {"imports": _imported - _start, "load_profile": _clock() - _imported}
+    mo.md(
+        f"Profile **{_profile.name}** loaded in {startup['load_profile']:.2f} s, after {startup['imports']:.2f} s of imports."
+    ).callout(kind="info")
+    return get_profile, load_profile, startup
+
+
+@app.cell(hide_code=True)
+def datatypes(load_profile_button, mo):
     mo.stop(not load_profile_button.value)  # run on click
 
-    from aiida.engine import run                  # run jobs
-    from aiida.plugins import CalculationFactory  # generates fans calculation
     from aiida.orm import (
         Group,                                    # node organisation tool
         SinglefileData,                           # \
@@ -595,24 +661,16 @@ def imports(load_profile_button, mo):
         List,                                     # |
         Dict,                                     # |
         ArrayData,                                # /
+        Data,                                     # base type of all datatypes
         CalcJobNode,                              # node type for calculation jobs
         QueryBuilder,                             # advanced query tool
         load_node,                                # basic query tool for nodes
         load_code,                                # basic query tool for codes
     )
-    from numpy import array                       # numpy array
-    from itertools import product                 # for parameter space generation
-    from random import uniform                    # for parameter space generation
-
-    from aiida import load_profile                # injects profile context into script
-    try: 
-        load_profile()
-    except:
-        mo.stop(True, output=mo.md("**Your profile failed to load properly!**").style(text_align="center").callout(kind="danger"))
     return (
         ArrayData,
         CalcJobNode,
-        CalculationFactory,
+        Data,
         Dict,
         Float,
         Group,
@@ -621,13 +679,8 @@ def imports(load_profile_button, mo):
         QueryBuilder,
         SinglefileData,
         Str,
-        array,
         load_code,
         load_node,
-        load_profile,
-        product,
-        run,
-        uniform,
     )
 
 
@@ -713,30 +766,15 @@ def _(abs_path, mk_microstructure_button, mo):
     )
 
     _code = r"""
-    microstructurequery = QueryBuilder(
-    ).append(
-        SinglefileData, filters={
-            SinglefileData.fields.label: "microstructure"
-        }
-    ).all(
-        flat=True
+    microstructurefile = register_microstructure(
+        '""" + (r"/path/to/microstructure.h5" if not abs_path.value else abs_path.value) + r"""'
     )
 
-    if len(microstructurequery) == 0:
-        microstructurefile = SinglefileData(
-            Path('""" + (r"/path/to/microstructure.h5" if not abs_path.value else abs_path.value) + r"""'),
-            label="microstructure"
-        ).store()
-    elif len(microstructurequery) == 1:
-        microstructurefile = microstructurequery.pop()
-    else:
-        raise
-
     inputs.add_nodes(microstructurefile)           # add the node to the "inputs" group
     """
 
     mo.md(rf"""
-    Next, we store the microstructure file in the database. Using a similar strategy as with the group definition, the `QueryBuilder` first searches for existing microstructures. If none are found, we define a new one in the form of a `SinglefileData` node. This built-in AiiDA datatype points to a file via a path. Finally, the microstructure node is included in our "inputs" group.
+    Next, we store the microstructure file in the database. Using a similar strategy as with the group definition, we first search for an existing microstructure. Since microstructure files can be large, a helper function (see [Appendix H](#appendix)) identifies them by the SHA-256 digest of their contents, which is computed by streaming the file in chunks. The digest is only computed again if the file's size or modification time has changed since it was last registered. If no microstructure with the same digest is found, we define a new one in the form of a `SinglefileData` node. This built-in AiiDA datatype points to a file via a path. Finally, the microstructure node is included in our "inputs" group.
 
     {_form}
 
@@ -751,35 +789,18 @@ def _(abs_path, mk_microstructure_button, mo):
 
 @app.cell(hide_code=True)
 def microstructure(
-    Path,
-    QueryBuilder,
-    SinglefileData,
     abs_path,
     inputs,
     mk_microstructure_button,
     mo,
+    register_microstructure,
 ):
     mo.stop(not mk_microstructure_button.value)  # run on click
 
-    microstructurequery = QueryBuilder(
-    ).append(
-        SinglefileData, filters={
-            SinglefileData.fields.label: "microstructure"
-        }
-    ).all(flat=True)
-
-    if len(microstructurequery) == 0:
-        microstructurefile = SinglefileData(
-            Path(abs_path.value),
-            label="microstructure"
-        ).store()
-    elif len(microstructurequery) == 1:
-        microstructurefile = microstructurequery.pop()
-    else:
-        raise
+    microstructurefile = register_microstructure(abs_path.value)
 
     inputs.add_nodes(microstructurefile)
-    return microstructurefile, microstructurequery
+    return (microstructurefile,)
 
 
 @app.cell
@@ -794,11 +815,11 @@ def _(mo):
 
     ...
 
-    # Problem Type and Material Model: Moduli
-    Dict({"bulk_modulus": bulk, "shear_modulus": shear}, label="material_properties")
-     for bulk, shear in product(
-        [[uniform(50, 75), uniform(200, 250)] for _ in range(2)],
-        [[uniform(25, 50), uniform(150, 200)] for _ in range(2)]
+    # Problem Type and Material Model: Moduli, drawn lazily
+    Dict(moduli, label="material_properties")
+     for moduli in parameter_space(
+        {"bulk_modulus": [(50, 75), (200, 250)], "shear_modulus": [(25, 50), (150, 200)]},
+        n=4, method="lhs", seed=seed
     )
 
     # Solver Settings: Number of Iterations
@@ -812,7 +833,7 @@ def _(mo):
     mo.md(rf"""
     Now, we will define the rest of our parameters. This is mostly straightforward, but we treat `material_properties` and `macroscale_loading` a little differently.
 
-    - `material_properties`: A mock parameter space study is realised by randomly picking bulk and shear moduli from within a range.
+    - `material_properties`: A mock parameter space study is realised by sampling bulk and shear moduli for both phases from within a range. Rather than taking every combination of a few random picks, a helper function (see [Appendix I](#appendix)) spreads a fixed number of samples evenly over the whole space with a Latin hypercube.
     - `n_it`: Three different numbers of iterations are chosen.
 
     When it comes time to run our calculations, we will run the "product" of all these parameters.
@@ -843,14 +864,19 @@ def node_definition(
     Int,
     List,
     Str,
-    array,
     gatekeep1,
-    product,
-    uniform,
+    parameter_space,
 ):
     gatekeep1() # Ignore this line.
 
-    nodes = [
+    from itertools import chain                   # lazy concatenation
+    from numpy import array                       # numpy array
+    from numpy.random import SeedSequence         # fresh random entropy
+
+    seed = SeedSequence().entropy                 # draw the same samples every time the nodes are iterated
+
+    def nodes():                                  # the nodes one by one, so any number of samples fits in memory
+        return chain([
 
     # Microstructure Definition
     Str("/sphere/32x32x32/ms", label="ms_datasetname"),
@@ -859,12 +885,12 @@ def node_definition(
     # Problem Type and Material Model
     Str("mechanical", label="problem_type"),
     Str("LinearElasticIsotropic", label="matmodel")
-    ] + [
-    Dict({"bulk_modulus": bulk, "shear_modulus": shear}, label="material_properties")
-     for bulk, shear in product(
-        [[uniform(50, 75), uniform(200, 250)] for _ in range(2)],
-        [[uniform(25, 50), uniform(150, 200)] for _ in range(2)]
-    )] + [
+    ], (
+    Dict(moduli, label="material_properties")
+     for moduli in parameter_space(
+        {"bulk_modulus": [(50, 75), (200, 250)], "shear_modulus": [(25, 50), (150, 200)]},
+        n=4, method="lhs", seed=seed
+    )), [
 
     # Solver Settings
     Str("cg", label="method"),
@@ -890,34 +916,48 @@ def node_definition(
           "absolute_error", "phase_stress_average", "phase_strain_average", 
           "microstructure", "displacement"], label="results")
 
-    ]
-    return (nodes,)
+    ])
+    return SeedSequence, array, chain, nodes, seed
 
 
 @app.cell(hide_code=True)
 def _(mo):
-    mo.md(rf"""
+    mo.md(r"""
     While the cell above defined all the parameters, they still need to be stored in the database. Otherwise, they will be lost when the session ends. AiiDA automatically stores nodes when submitting them to a job, but it is good practice to handle this yourself. Moreover, you get to see your database grow step by step. After clicking the button below, try running `verdi node list` in your terminal to see all the new additions we've made so far, and `verdi node show <id>` for more information about specific nodes.
 
-    It is important to note that this time we did not make any checks through the QueryBuilder to ensure that indentical nodes don't already exist. This means that if you click the button below repeatedly, you *may* cause duplicate nodes to be created. Since these are some the first nodes we're making, it is not so critical, but in practice you would want to first fetch existing nodes you want to reuse before creating the remainder of the nodes you wish to study.
+    Unlike the group, we won't search for each of these nodes one by one. Instead, a helper function (see [Appendix D](#appendix)) computes a hash of every new node from its type, label, and contents, and looks a whole batch of them up in the database with a single query. Only the nodes that don't exist yet are stored, in a single database transaction per batch (see [Appendix C](#appendix)), and added to the "inputs" group. So, clicking the button below repeatedly won't create duplicate nodes. Notice, however, that the `material_properties` are drawn at random, so clicking the RUN button above again will define new ones.
+
+    The nodes are only created batch by batch, as they are stored, so even a parameter space of millions of samples never has to fit in memory at once. Each time, the samples are drawn anew from the same `seed`, so they are the same until the RUN button above is clicked again.
 
     ```py
-    for node in nodes:             # iterate over the list of new node
-        node.store()               # store each one in the database
-        inputs.add_nodes(node)     # assign each one to the "inputs" group
+    drawn = nodes()                                        # the nodes are only created as they are stored
+    for batch in iter(lambda: list(islice(drawn, 1000)), []):  # a batch of nodes at a time
+        stored_nodes, rate = store_unique(batch, inputs)   # store the new nodes and add them to "inputs"
     ```
     """)
     return
 
 
 @app.cell(hide_code=True)
-def node_storage(def_nodes_button, inputs, mo, nodes):
+def node_storage(def_nodes_button, inputs, mo, nodes, store_unique):
     mo.stop(not def_nodes_button.value)
 
-    for node in nodes:             # iterate over the list of new node
-        node.store()               # store each one in the database
-        inputs.add_nodes(node)     # assign each one to the "inputs" group
-    return (node,)
+    from itertools import islice
+
+    _new = _total = 0
+    _seconds = 0.0
+    _nodes = nodes()
+    for _batch in iter(lambda: list(islice(_nodes, 1000)), []):  # a batch of nodes at a time
+        _stored, _rate = store_unique(_batch, inputs)  # store the new nodes and add them to "inputs"
+        _batch_new = sum(node is stored for node, stored in zip(_batch, _stored))
+        _new, _total, _seconds = _new + _batch_new, _total + len(_batch), _seconds + (_batch_new / _rate if _rate else 0.0)
+    rate = _new / _seconds if _seconds else 0.0
+
+    mo.md(
+        f"Stored **{_new}** new nodes at **{rate:.1f}** nodes/sec. "
+        f"**{_total - _new}** already existed."
+    ).callout(kind="success")
+    return islice, rate
 
 
 @app.cell(hide_code=True)
@@ -932,14 +972,22 @@ def _(mo):
             ...
     }]
 
-    material_properties_params = [
-        {"material_properties": mp.pop()}
-        for mp in QueryBuilder().append(
-            Dict, filters={
-                Dict.fields.label: "material_properties"
+    material_properties_query = QueryBuilder().append(
+        Dict, filters={
+            Dict.fields.label: "material_properties"
+        }
+    )
+
+    def material_properties_params(page=100):     # streamed anew for every sweep
+        last = 0                                  # one page at a time, each read before jobs store nodes
+        while mps := QueryBuilder().append(
+            Dict, tag="mp", filters={
+                Dict.fields.label: "material_properties",
+                Dict.fields.pk: {">": last}
             }
-        ).iterall()
-    ]
+        ).order_by({"mp": "id"}).limit(page).all(flat=True):
+            yield from ({"material_properties": mp} for mp in mps)
+            last = mps[-1].pk
 
     n_it_params = [
         {"n_it": fetch("n_it", 100)},
@@ -951,7 +999,7 @@ def _(mo):
     mo.md(rf"""
     ### Executing Calculations
 
-    Now that all the input parameters have been specified, it it time to run some calculations. We create lists of dictionaries for each set of paramaters we wish to vary. In our case, `material_properties` need a list, as does `n_it`. Everything else falls into a list of length one. The keys of the dictionaries here are important and are specified by the plugin. More information is available in the documentation, but efforts are being made to synchronise these with the FANS parameter specification.
+    Now that all the input parameters have been specified, it it time to run some calculations. We create lists of dictionaries for each set of paramaters we wish to vary. In our case, `n_it` needs a list, while `material_properties` may hold as many samples as you like, so they are read from the database a page at a time as the calculations are started, rather than all at once. Everything else falls into a list of length one. The keys of the dictionaries here are important and are specified by the plugin. More information is available in the documentation, but efforts are being made to synchronise these with the FANS parameter specification.
 
     Below, some nodes are fetched using a helper function (see [Appendix A](#appendix)) which essentially queries the database for a single node with a particular label and value. You could also use the nodes we created above instead, passing them forward as variables, but here we demonstrate how you might run calculations using a either new or old nodes at once.
 
@@ -1013,76 +1061,181 @@ def parameter_definition(
         "results": fetch("results", ["stress", "strain", "stress_average", "strain_average", "absolute_error", "phase_stress_average", "phase_strain_average", "microstructure", "displacement"])
     }]
 
-    material_properties_params = [
-        {"material_properties": mp.pop()}
-        for mp in QueryBuilder().append(
-            Dict, filters={
-                Dict.fields.label: "material_properties"
+    material_properties_query = QueryBuilder().append(
+        Dict, filters={
+            Dict.fields.label: "material_properties"
+        }
+    )
+
+    def material_properties_params(page=100):     # streamed anew for every sweep
+        last = 0                                  # one page at a time, each read before jobs store nodes
+        while mps := QueryBuilder().append(
+            Dict, tag="mp", filters={
+                Dict.fields.label: "material_properties",
+                Dict.fields.pk: {">": last}
             }
-        ).iterall()
-    ]
+        ).order_by({"mp": "id"}).limit(page).all(flat=True):
+            yield from ({"material_properties": mp} for mp in mps)
+            last = mps[-1].pk
 
     n_it_params = [
         {"n_it": fetch("n_it", 100)},
         {"n_it": fetch("n_it", 200)},
         {"n_it": fetch("n_it", 300)}
     ]
-    return material_properties_params, n_it_params, some_params
+    return (
+        material_properties_params,
+        material_properties_query,
+        n_it_params,
+        some_params,
+    )
 
 
 @app.cell(hide_code=True)
 def _(code_settings, mo):
     calculate_button = mo.ui.run_button(label="RUN")
+    recompute_switch = mo.ui.switch(label="*force recomputation...*")
+    pack_size = mo.ui.number(start=1, stop=64, value=1, label="*parameter sets per job:*")
+    fields_switch = mo.ui.switch(label="*keep full fields...*")
+    expire_switch = mo.ui.switch(value=True, label="*delete fields older than a week...*")
 
     _code = r"""
-    FANSCalculation = CalculationFactory("fans")      # get the plugin's process class
+    FANSCalculation = averages_calculation()          # the plugin's process class, storing only averages
     code = {"code": load_code('""" + f"{"<code_label>')}" if code_settings.value is None else code_settings.value["label"] + "')}" : <22}" + """ # get the existing code node
 
-    for sp, mpp, nit in product(some_params, material_properties_params, n_it_params):
-        all_params = sp | mpp | nit                   # merge this permutation of params
-        run(FANSCalculation, all_params | code)       # finally run the job
+    mpiprocs = (                                      # use the autotuned process count, if any
+        tuned_mpiprocs(some_params[0]["microstructure"])
+        or code["code"].computer.get_default_mpiprocs_per_machine()
+        or 1                                          # if the computer doesn't set a default either
+    )
+    resources = {"metadata": {"options": {
+        "resources": {"num_machines": 1, "num_mpiprocs_per_machine": mpiprocs},
+        "retrieve_fields": False,                     # only store the scalar and averaged results
+    }}}
+
+    if expire_switch.value:                           # keep the fields of each job for a week
+        expire_fields(days=7)
+    total = material_properties_query.count() * len(some_params) * len(n_it_params)
+    jobs = sweep(                                     # run the jobs side by side
+        FANSCalculation,
+        (sp | mpp | nit | code | resources            # merge each permutation of params
+         for mpp in material_properties_params() for sp in some_params for nit in n_it_params),
+        mpiprocs=mpiprocs,
+        use_cache=True,                               # reuse identical finished calculations
+        pin="core" if code["code"].computer.transport_type == "core.local" else None,  # give each local job its own cores
+        clean=True,                                   # empty the work directories as each job finishes
+        max_scratch=0.9,                              # hold back new jobs while the scratch disk is 90% full
+    )
+    for job in monitor(jobs, total):                  # report each job as it completes
+        print(f"{job.process_label}<{job.pk}> {job.process_state.value} [{job.exit_status}]")
     """
 
     mo.md(rf"""
-    Once these lists are defined, we use the `product` function to explore every permutation of their contents. Each permutation is coupled with the code node, defined earlier, and given to the `run` function with the plugin specific `FANSCalculation` process class.
+    Once these lists are defined, we loop over every permutation of their contents. Each permutation is coupled with the code node, defined earlier, and given to the plugin specific `FANSCalculation` process class.
+
+    Rather than running one job at a time with AiiDA's `run` function, we hand every permutation to a small helper (see [Appendix B](#appendix)) which keeps several jobs running at once. Each job only occupies as many cores as it has MPI processes, so the helper starts as many jobs as fit on your machine, pins each of them to its own cores, and begins a new one as soon as another finishes. Iterating over the returned handle reports each job as it completes, while the progress of the whole sweep, and the convergence of the running jobs, is shown live below the button (see [Appendix M](#appendix)).
+
+    Each job uses as many MPI processes as you configured for your computer, unless a better number has been found for the microstructure by calibrating it (see [Appendix L](#appendix)).
+
+    Much like last time, we don't want to repeat work that has already been done. AiiDA can recognise when a calculation with identical inputs and code has already finished successfully, thanks to its hashing of nodes. Instead of running FANS again, the new calculation is then created as a copy of the old one, with its outputs linked. So, clicking the button below repeatedly will only run calculations whose permutations haven't been seen before. If you do want to run them all again, use the switch to force recomputation.
 
-    Much like last time, we aren't checking if these calculations have already been run, so clicking the button below repeatedly will request duplicate calulations to be run and duplicate results will be generated.
+    When each calculation only takes a few seconds, starting a job can take longer than the calculation itself. Choose more than one parameter set per job below to run several of them back to back within a single job instead (see [Appendix K](#appendix)).
 
-    {calculate_button}
+    Although every result listed in `results` is written by FANS, only the scalar and averaged ones are stored in the repository. The full fields, with a value for every voxel, are deleted with the working directory of each job as soon as it finishes, so the scratch disk doesn't fill up. Use the first switch below to keep them in the working directories instead, from where they are only copied into the repository when you ask for them (see [Appendix P](#appendix)). Unless you turn off the second switch, the working directories of jobs older than a week are deleted before the sweep starts, so kept fields don't pile up either.
+
+    {calculate_button} {recompute_switch} {pack_size} {fields_switch} {expire_switch}
 
     ```py
     {_code}
     ```
     """)
-    return (calculate_button,)
+    return calculate_button, expire_switch, fields_switch, pack_size, recompute_switch
 
 
 @app.cell(hide_code=True)
 def calculations(
-    CalculationFactory,
+    averages_calculation,
     calculate_button,
     code_settings,
+    expire_fields,
+    expire_switch,
+    fields_switch,
     load_code,
     material_properties_params,
+    material_properties_query,
+    members,
     mo,
+    monitor,
     n_it_params,
-    product,
-    run,
+    pack,
+    pack_size,
+    packed_calculation,
+    recompute_switch,
     some_params,
+    sweep,
+    tuned_mpiprocs,
 ):
     mo.stop(not calculate_button.value)
 
-    FANSCalculation = CalculationFactory("fans")      # get the plugin's process class
+    FANSCalculation = averages_calculation()          # the plugin's process class, storing only averages
     try:                                              # get the existing code node
         code = {"code": load_code(code_settings.value["label"])}
     except:
         mo.stop(True, output=mo.md("**Your code failed to load properly!**\n\nPlease submit the 'Define a Code' form in the [AiiDA Setup](aiida-setup) section.").style(text_align="center").callout(kind="danger"))
 
-    for sp, mpp, nit in product(some_params, material_properties_params, n_it_params):
-        all_params = sp | mpp | nit                   # merge this permutation of params
+    mpiprocs = (                                      # use the autotuned process count, if any
+        tuned_mpiprocs(some_params[0]["microstructure"])
+        or code["code"].computer.get_default_mpiprocs_per_machine()
+        or 1                                          # if the computer doesn't set a default either
+    )
+    resources = {"metadata": {"options": {
+        "resources": {"num_machines": 1, "num_mpiprocs_per_machine": mpiprocs},
+        "retrieve_fields": False,                     # only store the scalar and averaged results
+    }}}
+
+    if expire_switch.value:                           # keep the fields of each job for a week
+        expire_fields(days=7)
+    parameter_sets = (
+        sp | mpp | nit | code | resources             # merge each permutation of params
+        for mpp in material_properties_params() for sp in some_params for nit in n_it_params
+    )
+    total = material_properties_query.count() * len(some_params) * len(n_it_params)
+    if pack_size.value > 1:                           # run several parameter sets per job
+        process_class, parameter_sets = packed_calculation(), pack(parameter_sets, pack_size.value)
+        total = -(-total // pack_size.value)          # jobs, if every parameter set shares the rest
+    else:
+        process_class = FANSCalculation
+
+    jobs = sweep(                                     # run the jobs side by side
+        process_class,
+        parameter_sets,
+        mpiprocs=mpiprocs,
+        use_cache=not recompute_switch.value,         # reuse identical finished calculations
+        pin="core" if code["code"].computer.transport_type == "core.local" else None,
+        clean=not fields_switch.value,                # or leave the full fields on scratch, until they expire
+        max_scratch=0.9,                              # hold back new jobs while the scratch disk is 90% full
+    )
+    for job in monitor(jobs, total):                  # report each job as it completes
+        print(f"{job.process_label}<{job.pk}> {job.process_state.value} [{job.exit_status}]")
 
-        run(FANSCalculation, all_params | code)       # finally run the job
-    return FANSCalculation, all_params, code, mpp, nit, sp
+    mo.md(
+        f"**{sum(map(members, jobs.finished))}** parameter sets finished successfully and **{sum(map(members, jobs.failed))}** failed, "
+        f"in {len(jobs.finished) + len(jobs.failed)} jobs. "
+        f"**{sum(map(members, jobs.cached))}** were reused from the cache and "
+        f"**{sum(map(members, jobs.finished + jobs.failed)) - sum(map(members, jobs.cached))}** were run. "
+        f"Storing only what was asked for saved **{sum(job.base.extras.get('bytes_saved', 0) for job in jobs.finished) / 2**20:.1f}** MiB."
+    ).callout(kind="success" if not jobs.failed else "warn")
+    return (
+        FANSCalculation,
+        code,
+        job,
+        jobs,
+        mpiprocs,
+        parameter_sets,
+        process_class,
+        resources,
+        total,
+    )
 
 
 @app.cell(hide_code=True)
@@ -1092,7 +1245,7 @@ def _(mo):
     mo.md(rf"""
     ## Analysing the Results
 
-    Now that our calculations are complete, we can make use of the QueryBuilder again to find and analyse the results.
+    Now that our calculations are complete, we can make use of the QueryBuilder again to find and analyse the results. To select calculations by their inputs, a helper function (see [Appendix R](#appendix)) compiles conditions on several inputs into a single query, such as a range of bulk moduli together with a number of iterations.
 
     {query_button}
     """)
@@ -1111,15 +1264,8 @@ def _(mo, query_button):
     outs = ["retrieved", "temporary"]
     # outs = list(calc.outputs._get_keys())
     stresses_strains = [{"Effective Stress": stress, "Effective Strain": strain} for stress, strain in zip([0.1, 0.2], [0.9, 0.8])]
-    # log = calc.outputs.retrieved.get_object_content("input.json.log").split("\n")
-    # stresses = []
-    # strains = []
-    # for ln in log:
-    #     if "Effective Stress" in ln:
-    #         stresses.append(ln.lstrip("# Effective Stress .. "))
-    #     if "Effective Strain" in ln:
-    #         strains.append(ln.lstrip("# Effective Strain .. "))
-    # stress_strains = [{"Effective Stress": stress, "Effective Strain": strain} for stress, strain in zip(stresses, strains)]
+    # log = parse_log(calc.outputs.retrieved)
+    # stress_strains = [{"Effective Stress": case["stress"], "Effective Strain": case["strain"]} for case in log]
     return mat_props, n_its, outs, stresses_strains
 
 
@@ -1147,8 +1293,8 @@ def _(mat_props, mo, n_its, outs, query_button, stresses_strains):
     {outs}
     ```py
     # Effective Stress and Strain per Loading Condition:
-    log = calc.outputs.retrieved.get_object_content("input.json.log").split("\n")
-    ...
+    log = parse_log(calc.outputs.retrieved)
+    [{{"Effective Stress": case["stress"], "Effective Strain": case["strain"]}} for case in log]
     ```
     {stresses_strains}
     """)
@@ -1156,73 +1302,146 @@ def _(mat_props, mo, n_its, outs, query_button, stresses_strains):
 
 
 @app.cell(hide_code=True)
-def _(CalcJobNode, Int, QueryBuilder, mo, query_button):
+def _(
+    CalcJobNode,
+    Data,
+    Dict,
+    FIELDS,
+    Int,
+    QueryBuilder,
+    fetch_fields,
+    field,
+    filter_calcs,
+    mo,
+    open_results,
+    parse_log,
+    query_button,
+):
     mo.stop(not query_button.value)  # run on click
 
-    calcs = QueryBuilder().append(CalcJobNode).all(flat=True)
+    calc = QueryBuilder().append(                     # load a single calculation, not all of them
+        CalcJobNode,
+        filters={"attributes.exit_status": 0, "attributes.process_label": {"!==": "PackedFANSCalculation"}}
+    ).first(flat=True)
+
+    material_properties, n_it = QueryBuilder().append(  # project only the attributes of its inputs
+        CalcJobNode, filters={"id": calc.pk}, tag="calc"
+    ).append(
+        Dict, with_outgoing="calc", project="attributes", edge_filters={"label": "material_properties"}
+    ).append(
+        Int, with_outgoing="calc", project="attributes.value", edge_filters={"label": "n_it"}
+    ).first()
 
-    calc = calcs[0]
+    outputs = QueryBuilder().append(                  # and only the link labels of its outputs
+        CalcJobNode, filters={"id": calc.pk}, tag="calc"
+    ).append(
+        Data, with_incoming="calc", edge_project="label"
+    ).all(flat=True)
 
     print("For a Single Calculation with the Following Inputs...")
 
     print()
     print("Material Properties:")
-    for k, v in calc.inputs.material_properties.items():
+    for k, v in material_properties.items():
         print(f"{k}\t{v}")
 
     print()
     print("Number of Iterations:")
-    print(calc.inputs.n_it.value)
+    print(n_it)
 
 
     print()
-    print(f"The Available Outputs: {list(calc.outputs._get_keys())}")
+    print(f"The Available Outputs: {outputs}")
+    print()
+    with open_results(calc.outputs.results) as h5:   # h5 output, read lazily in place
+        datasets = []
+        h5.visit(datasets.append)
+        stress_averages = {
+            name: field(h5[name])[()] for name in datasets if name.endswith("/stress_average")
+        }
+
+    print("Stress Averages in the Results File:")
+    print(*stress_averages.items(), sep="\n")
+    print()
+
+    try:
+        with open_results(fetch_fields(calc)) as h5:  # full fields, fetched from scratch on first use
+            field_shapes = {}
+            h5.visititems(lambda name, obj: field_shapes.update(
+                {name: obj.shape} if name.rsplit("/", 1)[-1] in FIELDS else {}
+            ))
+        print("Full Fields Kept on Scratch:")
+        print(*field_shapes.items(), sep="\n")
+    except FileNotFoundError as _error:           # the fields weren't kept, or have expired
+        print(_error)
     print()
-    calc.outputs.results # h5 output
 
-    log = calc.outputs.retrieved.get_object_content("input.json.log").split("\n")
+    log = parse_log(calc.outputs.retrieved)
 
-    stresses = []
-    strains = []
-    for ln in log:
-        if "Effective Stress" in ln:
-            stresses.append(ln.lstrip("# Effective Stress .. "))
-        if "Effective Strain" in ln:
-            strains.append(ln.lstrip("# Effective Strain .. "))
-    stress_strains = [{"Effective Stress": stress, "Effective Strain": strain} for stress, strain in zip(stresses, strains)]
+    stress_strains = [{"Effective Stress": case["stress"], "Effective Strain": case["strain"]} for case in log]
 
     print("Effective Stress and Strain per Loading Condition:")
     print(*stress_strains, sep="\n")
 
-    filtered_calcs = QueryBuilder().append(
-        Int,
-        filters={
-            Int.fields.label: "n_it",
-            Int.fields.value: {"==": 200}
-        },
-        tag="n_it"
-    ).append(
-        CalcJobNode,
-        with_incoming="n_it"
-    ).all(flat=True)
+    filtered_calcs = filter_calcs(                    # one query, joining each of these inputs
+        project=["id", "uuid", "attributes.process_label"],
+        n_it=200,
+        method="cg",
+        error_parameters__tolerance=(None, 1e-8),
+    )
 
     print()
-    print("Calculation Jobs with n_it = 200:")
-    print(*filtered_calcs, sep="\n")
+    print("Calculation Jobs with n_it = 200, method = cg, and tolerance <= 1e-8:")
+    for pk, uuid, process_label in filtered_calcs.iterall(batch_size=1000):  # streamed, in batches
+        print(f"{process_label}<{pk}> {uuid}")
     return (
         calc,
-        calcs,
+        datasets,
+        field_shapes,
         filtered_calcs,
+        h5,
         k,
-        ln,
         log,
-        strains,
+        material_properties,
+        n_it,
+        outputs,
+        pk,
+        process_label,
+        stress_averages,
         stress_strains,
-        stresses,
+        uuid,
         v,
     )
 
 
+@app.cell(hide_code=True)
+def _(mo, query_button):
+    mo.stop(not query_button.value)  # run on click
+
+    mo.md(r"""
+    Reading one calculation at a time like this is fine for exploring, but every access to `calc.inputs` or `calc.outputs` is another trip to the database. To compare all of our calculations at once, we use a helper function (see [Appendix F](#appendix)) which joins every calculation to its inputs and outputs in a single query. Each parameter set of a packed job gets its own rows, told apart by the `member` column. The rows are streamed in batches and only their attributes are projected, so no node is loaded and the memory used stays the same however many calculations there are. The result is a table with one row per calculation and loading case.
+
+    ```py
+    table = results_table(batch_size=1000)
+    ```
+    """)
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo, query_button, results_table):
+    mo.stop(not query_button.value)  # run on click
+
+    table = results_table(batch_size=1000)
+
+    _shown = table[:100]                              # only the rows shown are converted, `table` stays an array
+    mo.vstack([
+        mo.ui.table([{name: row[name].tolist() for name in _shown.dtype.names} for row in _shown], selection=None),
+        mo.md(f"Showing {len(_shown)} of the {len(table)} rows of `table`, a NumPy structured array."),
+    ])
+    return (table,)
+
+
 @app.cell(hide_code=True)
 def _(mo):
     mo.md(r"""# Appendix""")
@@ -1235,52 +1454,1875 @@ def _(mo):
         r"""
         ## A. `fetch()`
 
-        This is a helper function to simplify the querying of individual nodes when the label and value are known.
+        This is a helper function to simplify the querying of individual nodes when the label and value are known. Rather than querying the database on every call, it loads every labelled node of the requested datatype once and answers later calls from memory. Only nodes stored since are looked up one by one, which AiiDA's index on the label keeps fast, helped on PostgreSQL by the indexes of [Appendix Q](#appendix).
         """
     )
     return
 
 
 @app.cell
-def _(Dict, Float, Int, List, QueryBuilder, Str, mo):
-    def fetch(label : str, value):
-        """Helper function to return a node whose label and value are known.
+def fetch_helper(Dict, Float, Int, List, QueryBuilder, Str, mo):
+    _index = {}  # datatype -> {(label, value): [node, ...]}
 
-        Returns an error if more or less than 1 suitable node is found.
-        """
+    def _key(label, value):
+        from json import dumps
+
+        return (label, dumps(value, sort_keys=True))
+
+    def _value(node):
+        return node.get_dict() if isinstance(node, Dict) else node.get_list() if isinstance(node, List) else node.value
+
+    def _datatype(value):
         match value:
             case str():
-                datatype = Str
+                return Str
             case int():
-                datatype = Int
+                return Int
             case float():
-                datatype = Float
+                return Float
             case list():
-                datatype = List
+                return List
             case dict():
-                datatype = Dict
+                return Dict
             case _:
                 raise NotImplementedError
 
-        bone = QueryBuilder().append(
-            datatype,
-            filters={
-                datatype.fields.label: label,
-                "attributes.value": value
-            } if datatype is not List else {
-                datatype.fields.label: label,
-                "attributes.list": value
-            },
-        ).all(flat=True)
+    def _prefetch(datatype):
+        """Index every labelled node of `datatype` with a single query."""
+        entries = {}
+        for (node,) in QueryBuilder().append(
+            datatype, filters={datatype.fields.label: {"!==": ""}}
+        ).iterall(batch_size=1000):
+            entries.setdefault(_key(node.label, _value(node)), []).append(node)
+        return entries
+
+    def _query(label, value):
+        """Return the query for the nodes with the given label and value."""
+        from aiida.manage import get_manager
+
+        datatype = _datatype(value)
+        filters = {datatype.fields.label: label}
+        if datatype is not Dict:
+            path = "attributes.list" if datatype is List else "attributes.value"
+            if get_manager().get_profile_storage().profile.storage_backend == "core.psql_dos":
+                filters[path] = {"contains": value}  # matches the indexes of Appendix Q
+            else:
+                filters[path] = value
+        return QueryBuilder().append(datatype, filters=filters)
+
+    def fetch(label : str, value):
+        """Helper function to return a node whose label and value are known.
+
+        Every labelled node of the same datatype is indexed by a single query on
+        first use, so later calls are answered from memory. Nodes stored since are
+        picked up on a miss by a query for the label and value alone, kept fast by
+        the label index, and on PostgreSQL by those of `ensure_indexes()`, or all at
+        once after `fetch.cache_clear()`.
+        This query is returned by `fetch.query()`.
+
+        Returns an error if more or less than 1 suitable node is found.
+        """
+        datatype = _datatype(value)
+        if datatype not in _index:
+            _index[datatype] = _prefetch(datatype)
+
+        key = _key(label, value)
+        bone = _index[datatype].get(key)
+        if not bone:
+            bone = _index[datatype][key] = [  # containment and numeric comparisons may match more than the value
+                node for node in _query(label, value).all(flat=True) if _key(node.label, _value(node)) == key
+            ]
 
         if len(bone) != 1:
             raise RuntimeError
 
-        return bone.pop()
+        return bone[0]
+
+    fetch.cache_clear = _index.clear
+    fetch.query = _query
 
     mo.show_code()
     return (fetch,)
 
 
-if __name__ == "__main__":
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## B. `sweep()`
+
+        This is a helper function to run many calculations side by side. Rather than waiting for each job to finish before starting the next, it keeps a fixed number of jobs in flight on AiiDA's in-process runner and starts a new one whenever another terminates. By default, as many jobs are run at once as there are cores available for their MPI processes, and calculations identical to one that already finished are taken from AiiDA's cache.
+
+        Left to themselves, the MPI ranks of jobs running side by side on one machine are placed on the same cores, where they fight over the caches and slow each other down. So, for jobs run on this machine, each job can be pinned to its own set of cores, preferably within one NUMA node. Every core has its own lock file, and the job script takes hold of the locks of all the cores in a set before starting FANS, so jobs of several sweeps never share a core either, even if they use different numbers of MPI processes. As the job script doesn't depend on which set a job gets, calculations are still taken from the cache.
+
+        Once the outputs of a job have been retrieved and stored, its working directory on the computer is no longer needed, and can be deleted straight away. For jobs run on this machine, new jobs can also be held back while the disk holding the work directories is nearly full, until running jobs have finished and been cleaned up. If the disk is already full before the sweep starts, the jobs are run one at a time, with a warning, rather than not at all.
+        """
+    )
+    return
+
+
+@app.cell
+def sweep_helper(clean_workdir, mo):
+    class Sweep:
+        """Handle on a parameter sweep running in the background.
+
+        Iterating over the handle drives the sweep and yields each `CalcJobNode`
+        as soon as it terminates. The jobs seen so far are kept in `finished` and
+        `failed`, while those still in flight are listed by `running`. Jobs that
+        were copied from an identical earlier calculation are also kept in `cached`.
+        """
+
+        def __init__(self, process_class, inputs, max_concurrent, use_cache, clean=False, max_scratch=None):
+            from functools import partial
+            from aiida.manage import get_manager
+            from aiida.manage.caching import disable_caching, enable_caching
+
+            self._runner = get_manager().get_runner()
+            self._process_class = process_class
+            self._inputs = iter(inputs)
+            self.max_concurrent = max_concurrent
+            self._caching = partial(
+                enable_caching if use_cache else disable_caching,
+                identifier=process_class.build_process_type(),
+            )
+            self._clean = clean
+            self._max_scratch = max_scratch
+            self._warned = False
+            self._pending = None
+            self._tasks = {}
+            self.finished = []
+            self.failed = []
+            self.cached = []
+
+        @property
+        def running(self):
+            return list(self._tasks.values())
+
+        def _scratch_full(self, inputs):
+            """Whether the disk holding the work directory of a local job is too full."""
+            from getpass import getuser
+            from pathlib import Path
+            from shutil import disk_usage
+
+            if self._max_scratch is None or "code" not in inputs:
+                return False
+            computer = inputs["code"].computer
+            if computer.transport_type != "core.local":
+                return False
+            path = Path(computer.get_workdir().format(username=getuser()))
+            while not path.exists():
+                path = path.parent
+            usage = disk_usage(path)
+            return usage.used > self._max_scratch * usage.total
+
+        def _fill(self):
+            """Start new jobs until the limit is reached, the inputs run out, or the
+            scratch disk is full. While no job is in flight, one is started anyway,
+            since nothing else would free the disk."""
+            from warnings import warn
+
+            while len(self._tasks) < self.max_concurrent:
+                if self._pending is None:
+                    self._pending = next(self._inputs, None)
+                    if self._pending is None:
+                        return
+                if self._scratch_full(self._pending):
+                    if self._tasks:
+                        return
+                    if not self._warned:
+                        warn(f"The scratch disk is more than {self._max_scratch:.0%} full, so jobs are run one at a time.")
+                        self._warned = True
+                with self._caching():
+                    process = self._runner.instantiate_process(self._process_class, **self._pending)
+                self._pending = None
+                task = self._runner.loop.create_task(process.step_until_terminated())
+                self._tasks[task] = process.node
+
+        def __iter__(self):
+            return (node for node in self.watch() if node is not None)
+
+        def watch(self, interval=None):
+            """Drive the sweep like iterating over it, but also yield `None` every
+            `interval` seconds in which no job terminates."""
+            from asyncio import FIRST_COMPLETED, wait
+
+            self._fill()
+            while self._tasks:
+                done, _ = self._runner.loop.run_until_complete(
+                    wait(self._tasks, timeout=interval, return_when=FIRST_COMPLETED)
+                )
+                if not done:
+                    yield None
+                for task in done:
+                    node = self._tasks.pop(task)
+                    if task.exception() is None and node.is_finished_ok:
+                        self.finished.append(node)
+                        if self._clean and not node.base.caching.is_created_from_cache:
+                            clean_workdir(node.outputs.remote_folder)
+                    else:
+                        self.failed.append(node)
+                    if node.base.caching.is_created_from_cache:
+                        self.cached.append(node)
+                    yield node
+                self._fill()
+
+        def wait(self):
+            """Block until every job in the sweep has terminated."""
+            for _ in self:
+                pass
+            return self
+
+    def cpu_slots(mpiprocs, numa=False):
+        """Helper function to split the available cores into disjoint sets for jobs.
+
+        Each set holds `mpiprocs` cores of the same NUMA node where possible or,
+        with `numa`, every available core of one NUMA node. If there are fewer
+        than `mpiprocs` cores, the only set holds all of them.
+        """
+        from glob import glob
+        from os import sched_getaffinity
+
+        available = sched_getaffinity(0)
+        nodes = []
+        for path in sorted(glob("/sys/devices/system/node/node*/cpulist")):
+            with open(path) as handle:
+                cpus = set()
+                for part in handle.read().strip().split(","):
+                    if part:
+                        first, _, last = part.partition("-")
+                        cpus.update(range(int(first), int(last or first) + 1))
+            if cpus & available:
+                nodes.append(sorted(cpus & available))
+        if not nodes:                                 # no NUMA information
+            nodes = [sorted(available)]
+
+        if numa and (slots := [node for node in nodes if len(node) >= mpiprocs]):
+            return slots
+        slots = [node[i:i + mpiprocs] for node in nodes for i in range(0, len(node) - mpiprocs + 1, mpiprocs)]
+        if not slots:                                 # jobs larger than a NUMA node span several
+            cores = [cpu for node in nodes for cpu in node]
+            slots = [cores[i:i + mpiprocs] for i in range(0, len(cores) - mpiprocs + 1, mpiprocs)] or [cores]
+        return slots
+
+    def _pinned(inputs, directory, slots):
+        """Add a job script prologue which pins the job to a free set of cores."""
+        prologue = "\n".join([
+            "_lock() {                                     # lock every core of a set, or none of them",
+            "    local _core _fd _held=()",
+            "    for _core in ${1//,/ }; do",
+            f"        exec {{_fd}}>>'{directory}'/$_core",
+            "        _held+=($_fd)",
+            "        if ! flock -n $_fd; then",
+            "            for _fd in ${_held[@]}; do exec {_fd}>&-; done",
+            "            return 1",
+            "        fi",
+            "    done",
+            "}",
+            "while :; do                                   # wait for a free set of cores",
+            f"    for _slot in {' '.join(','.join(map(str, slot)) for slot in slots)}; do",
+            "        _lock $_slot && break 2               # and hold their locks until the job ends",
+            "    done",
+            "    sleep 1",
+            "done",
+            'taskset -cp "$_slot" $$ > /dev/null           # the MPI ranks inherit the affinity',
+            "",
+        ])
+        metadata = inputs.get("metadata", {})
+        options = metadata.get("options", {})
+        return inputs | {"metadata": metadata | {"options": options | {
+            "prepend_text": prologue + options.get("prepend_text", ""),
+        }}}
+
+    def sweep(
+        process_class, inputs, max_concurrent=None, mpiprocs=1, use_cache=True, pin=None, clean=False, max_scratch=None
+    ):
+        """Helper function to run a process for every set of inputs concurrently.
+
+        The inputs are consumed lazily, so they may be given as a generator. If
+        `max_concurrent` is not given, it is chosen to fill the available cores
+        with jobs of `mpiprocs` processes each. With `use_cache`, a job whose
+        inputs match a calculation that already finished successfully reuses its
+        outputs instead of running again; disable it to force recomputation.
+
+        For jobs run on this machine, `pin="core"` pins each job to its own set
+        of `mpiprocs` cores, and `pin="numa"` to its own NUMA node. Every core is
+        locked by at most one job, so jobs of other sweeps, whatever their
+        `mpiprocs`, wait for the cores of a set to be free.
+
+        With `clean`, the remote working directory of each successful job is
+        deleted once its retrieved outputs are stored. With `max_scratch`, no new
+        local job is started while the disk holding the work directory is more
+        than this fraction full, unless no other job is running.
+        """
+        from os import getuid, sched_getaffinity
+        from pathlib import Path
+        from tempfile import gettempdir
+
+        if pin is not None:
+            slots = cpu_slots(mpiprocs, numa=pin == "numa")
+            root = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(gettempdir())
+            directory = root / f"aiida-fans-{getuid()}"  # shared by the sweeps of every `pin` and `mpiprocs`
+            directory.mkdir(exist_ok=True)
+            for core in {core for slot in slots for core in slot}:
+                (directory / str(core)).touch()       # never removed, as running jobs may hold them
+            max_concurrent = min(max_concurrent or len(slots), len(slots))
+            inputs = (_pinned(parameters, directory, slots) for parameters in inputs)
+
+        if max_concurrent is None:
+            max_concurrent = max(1, len(sched_getaffinity(0)) // mpiprocs)
+
+        return Sweep(process_class, inputs, max_concurrent, use_cache, clean, max_scratch)
+
+    mo.show_code()
+    return Sweep, cpu_slots, sweep
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## C. `store_all()`
+
+        This is a helper function to store many nodes at once. All the nodes are written to the database in a single transaction, and then added to a group with a single call, rather than committing each node on its own.
+        """
+    )
+    return
+
+
+@app.cell
+def store_all_helper(fetch, mo):
+    def store_all(nodes, group=None):
+        """Helper function to store a list of nodes in a single transaction.
+
+        The nodes are added to `group`, if given, in one go, and the index behind
+        `fetch()` is cleared. Returns the number of nodes stored per second.
+        """
+        from time import perf_counter
+        from aiida.manage import get_manager
+
+        start = perf_counter()
+        with get_manager().get_profile_storage().transaction():
+            for node in nodes:
+                if not node.is_stored:
+                    node.store()
+        if group is not None:
+            group.add_nodes(nodes)
+        fetch.cache_clear()
+
+        return len(nodes) / (perf_counter() - start)
+
+    mo.show_code()
+    return (store_all,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## D. `store_unique()`
+
+        This is a helper function to store only those nodes which don't already exist. Each node is identified by a hash of its type and contents together with its label. The hashes of a whole list of nodes are looked up with a single query, so storing the same nodes again costs one query and no writes besides adding them to the group.
+        """
+    )
+    return
+
+
+@app.cell
+def store_unique_helper(QueryBuilder, mo, store_all):
+    def store_unique(nodes, group=None):
+        """Helper function to store the nodes of a list that don't already exist.
+
+        Nodes with the same type, contents, and label as a stored node are
+        replaced by the stored node. Every resulting node, whether new or found,
+        is added to `group`, if given. Returns the resulting list of nodes, in
+        order, and the number of new nodes stored per second.
+        """
+        from aiida.common.hashing import make_hash
+        from aiida.orm import Node
+
+        def node_hash(node):
+            if node.is_stored:
+                return node.base.caching.compute_hash()
+            return make_hash(node.base.caching.get_objects_to_hash())  # as compute_hash() refuses unstored nodes
+
+        keys = [(node_hash(node), node.label) for node in nodes]
+        existing = {
+            (node_hash, node.label): node
+            for node, node_hash in QueryBuilder().append(
+                Node,
+                filters={"extras._aiida_hash": {"in": list({key[0] for key in keys})}},
+                project=["*", "extras._aiida_hash"],
+            ).iterall()
+        }
+
+        new = {}
+        for node, key in zip(nodes, keys):
+            if key not in existing:
+                new.setdefault(key, node)
+
+        rate = store_all(list(new.values())) if new else 0.0
+        stored = [existing[key] if key in existing else new[key] for key in keys]
+        if group is not None:
+            group.add_nodes(list({node.pk: node for node in stored}.values()))
+
+        return stored, rate
+
+    mo.show_code()
+    return (store_unique,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## E. `parse_log()`
+
+        This is a helper function to read the results FANS reports in its log, `input.json.log`. The log is streamed from the repository line by line, so even very long logs are never held in memory at once. Instead of the `retrieved` node, the `repository_metadata` projected by a `QueryBuilder` may be passed, so that the log is opened without loading any node. For every macroscale loading case, it returns the effective stress and strain of each time step, the residual of every solver iteration, and any reported timings as NumPy arrays. The loading cases and time steps are told apart by the markers FANS writes, and anything reported after the effective values of a time step, such as the time it took, is kept with it.
+        """
+    )
+    return
+
+
+@app.cell
+def parse_log_helper(mo):
+    def parse_log(retrieved, filename="input.json.log", time_steps=None):
+        """Helper function to parse the FANS log of a calculation.
+
+        The `retrieved` folder may be given as its node, or as the value of its
+        `repository_metadata` projected by a `QueryBuilder`, in which case the
+        node is never loaded.
+
+        Returns a list with one record per macroscale loading case. Each record
+        holds the index of the `load_case`, and NumPy arrays of the effective
+        `stress` and `strain` with one row per time step, the `residuals` of each
+        iteration, the number of `iterations` of each time step, and the
+        `timings` reported in seconds.
+
+        Loading cases are told apart by the markers FANS writes for them. In logs
+        without markers, they are made up of `time_steps[i]` time steps each, by
+        default one. A time step ends with its effective values, but lines after
+        them, such as timings, still belong to it until the next one starts.
+        """
+        from io import TextIOWrapper
+        from re import IGNORECASE, compile
+        from numpy import array
+        from aiida.manage import get_manager
+
+        if isinstance(retrieved, dict):
+            repository = get_manager().get_profile_storage().get_repository()
+            opened = repository.open(retrieved["o"][filename]["k"])
+        else:
+            opened = retrieved.base.repository.open(filename, mode="rb")
+
+        effective = compile(r"^# Effective (Stress|Strain) \.\. \((.*)\)")
+        iteration = compile(r"^it\s+\d+\s.*?err\s+(\S+?),?\s")
+        timing = compile(r"time[^:]*:\s*([-+0-9.eE]+)\s*sec", IGNORECASE)
+        marker = compile(r"load[ _]?(?:case|path)\D*?(\d+)", IGNORECASE)
+
+        cases = []
+        steps = iter(time_steps or ())
+        marked = False                                # whether the log marks its loading cases
+        remaining = 0                                 # time steps left in the current case, without markers
+        ended = True                                  # whether the current time step has its effective values
+
+        def start_case(index):
+            cases.append({
+                "load_case": index, "stress": [], "strain": [], "residuals": [], "iterations": [], "timings": []
+            })
+
+        def start_step():
+            nonlocal remaining, ended
+            if not marked and remaining == 0 or not cases:
+                start_case(len(cases))
+                remaining = next(steps, 1)
+            remaining -= 1
+            cases[-1]["iterations"].append(0)
+            ended = False
+
+        with opened as handle:
+            for line in TextIOWrapper(handle, encoding="utf-8"):
+                if line.startswith("it"):
+                    if match := iteration.match(line):
+                        if ended:
+                            start_step()
+                        cases[-1]["residuals"].append(float(match.group(1)))
+                        cases[-1]["iterations"][-1] += 1
+                elif line.startswith("#") and (match := effective.match(line)):
+                    if ended:
+                        start_step()
+                    case = cases[-1]
+                    case[match.group(1).lower()].append(array(match.group(2).split(), dtype=float))
+                    ended = len(case["stress"]) == len(case["strain"]) == len(case["iterations"])
+                elif match := marker.search(line):
+                    if not cases or int(match.group(1)) != cases[-1]["load_case"]:
+                        start_case(int(match.group(1)))
+                        ended = True
+                    marked = True
+                if cases and (match := timing.search(line)):
+                    cases[-1]["timings"].append(float(match.group(1)))
+
+        return [
+            case | {name: array(case[name]) for name in ("stress", "strain", "residuals", "iterations", "timings")}
+            for case in cases
+        ]
+
+    mo.show_code()
+    return (parse_log,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## F. `results_table()`
+
+        This is a helper function to gather the results of every calculation into a single table. One `QueryBuilder` joins each successfully finished calculation, leaving out those reused from the cache and the calibration solves of [Appendix L](#appendix), to its `material_properties` and `retrieved` nodes, projecting only the attributes and the repository metadata needed, and a second one, streamed alongside it, to its `n_it`. The log of each calculation is then parsed (see [Appendix E](#appendix)). The inputs of the members of a packed job (see [Appendix K](#appendix)) are matched by the key in their link labels, and each member's own log is parsed. The rows are streamed in batches of `batch_size`, with `iter_results()`, so no node is ever loaded and the memory used besides the table itself stays the same however many calculations there are. The table is a NumPy structured array with one row per parameter set and loading case.
+        """
+    )
+    return
+
+
+@app.cell
+def results_table_helper(CalcJobNode, Dict, Int, QueryBuilder, mo, parse_log):
+    def iter_results(batch_size=1000):
+        """Helper function to stream the results of all FANS calculations.
+
+        Yields a dictionary per parameter set and macroscale loading case, with
+        the `pk` and `uuid` of the calculation, the key of the `member` of a
+        packed job, empty otherwise, the index of the `load_case`, each material
+        property, `n_it`, and the effective `stress` and `strain` at the end of
+        the loading case. Calculations reused from the cache, and the calibration
+        solves of `autotune()`, are left out, so every result is yielded once.
+        The rows are fetched `batch_size` at a time and only their attributes
+        are projected, so no node is loaded.
+        """
+        from itertools import groupby
+        from aiida.common.escaping import escape_for_sql_like
+        from aiida.orm import ArrayData, FolderData
+
+        def member(label):                            # "material_properties__m0" -> "m0"
+            return label.partition("__")[2]
+
+        def time_steps(attributes):                   # {"array|0": [1, 6], ...} -> [1, ...], in order of the cases
+            shapes = {name.partition("|")[2]: shape for name, shape in attributes.items() if name.startswith("array|")}
+            return [shapes[name][0] for name in sorted(shapes, key=lambda name: (len(name), name))]
+
+        def query(datatype, label, project):          # the inputs of every calculation, in order
+            return QueryBuilder().append(
+                CalcJobNode, tag="calc", project=["id", "uuid"],
+                filters={
+                    "attributes.exit_status": 0,
+                    "extras": {"and": [{"!has_key": "_aiida_cached_from"}, {"!has_key": "autotune"}]},
+                }
+            ).append(
+                datatype, with_outgoing="calc", tag=label, project=project,
+                edge_filters={"label": {"or": [                 # "n_it" or "n_it__<key>"
+                    {"==": label}, {"like": f"{escape_for_sql_like(f'{label}__')}%"}
+                ]}},
+                edge_tag="link", edge_project="label"
+            ).order_by({"calc": "id"})
+
+        n_its = groupby(
+            query(Int, "n_it", "attributes.value").iterall(batch_size=batch_size), key=lambda row: row[0]
+        )
+        pending = next(n_its, None)
+        keys = []
+        for pk, rows in groupby(
+            query(Dict, "material_properties", "attributes").append(
+                ArrayData, with_outgoing="calc", tag="loading", project="attributes",
+                edge_filters={"label": "macroscale_loading"}
+            ).append(
+                FolderData, with_incoming="calc", tag="retrieved", project="repository_metadata",
+                edge_filters={"label": "retrieved"}
+            ).iterdict(batch_size=batch_size),
+            key=lambda row: row["calc"]["id"],
+        ):
+            while pending is not None and pending[0] < pk:  # both queries are ordered by calculation
+                pending = next(n_its, None)
+            if pending is None or pending[0] != pk:
+                raise ValueError(f"The calculation {pk} has no `n_it` input.")
+            n_it = {member(label): value for _, _, value, label in pending[1]}
+            for row in rows:
+                set_key = member(row["link"]["label"])
+                if set_key not in n_it:
+                    raise ValueError(f"The calculation {pk} has no `n_it` input for the member `{set_key}`.")
+                properties = row["material_properties"]["attributes"]
+                keys = keys or sorted(properties)
+                log = f"{set_key}.json.log" if set_key else "input.json.log"
+                steps = time_steps(row["loading"]["attributes"])
+                for case in parse_log(row["retrieved"]["repository_metadata"], log, steps):
+                    yield {
+                        "pk": pk,
+                        "uuid": row["calc"]["uuid"],
+                        "member": set_key,
+                        **{key: properties[key] for key in keys},
+                        "n_it": n_it[set_key],
+                        "load_case": case["load_case"],
+                        "stress": case["stress"][-1],
+                        "strain": case["strain"][-1],
+                    }
+
+    def results_table(batch_size=1000):
+        """Helper function to tabulate the results of all FANS calculations.
+
+        Returns a NumPy structured array with one row per parameter set and
+        macroscale loading case. Besides the `pk` of the calculation, the key of
+        the `member` of a packed job, and the index of the `load_case`, there is
+        a column for each material property, `n_it`, and the effective `stress`
+        and `strain`.
+        """
+        from itertools import chain
+        from numpy import fromiter, shape, zeros
+
+        def dtype(row):                               # every material property is a float column
+            return [
+                (name, "U32" if name == "member" else int if name in ("pk", "n_it", "load_case") else float, shape(value))
+                for name, value in row.items() if name != "uuid"
+            ]
+
+        results = iter_results(batch_size)
+        if (first := next(results, None)) is None:    # no material properties to name the columns after
+            return zeros(0, dtype=dtype(
+                {"pk": 0, "member": "", "n_it": 0, "load_case": 0, "stress": zeros(6), "strain": zeros(6)}
+            ))
+
+        names = [name for name, *_ in dtype(first)]
+        return fromiter((tuple(row[name] for name in names) for row in chain([first], results)), dtype=dtype(first))
+
+    mo.show_code()
+    return iter_results, results_table
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## G. `open_results()` and `field()`
+
+        These are helper functions to read the HDF5 results of a calculation without copying the file out of the repository. The file is opened in place and its datasets are only read when sliced. When a dataset is stored contiguously in a file on disk, `field()` memory-maps it instead, so that a slice is read straight from the page cache.
+        """
+    )
+    return
+
+
+@app.cell
+def open_results_helper(mo):
+    from contextlib import contextmanager
+
+    @contextmanager
+    def open_results(results):
+        """Helper function to open the HDF5 results of a calculation in place.
+
+        Yields the open `h5py.File`, whose datasets are only read when sliced.
+        """
+        from os.path import isfile
+        import h5py
+
+        with results.open(mode="rb") as handle:
+            if isinstance(getattr(handle, "name", None), str) and isfile(handle.name):
+                h5 = h5py.File(handle.name, "r")  # a loose object may be opened directly
+            else:
+                h5 = h5py.File(handle, "r")
+            with h5:
+                yield h5
+
+    def field(dataset):
+        """Helper function to return an HDF5 dataset as a sliceable array.
+
+        Contiguous, uncompressed datasets in a file on disk are memory-mapped. Any
+        other dataset is returned as is, which h5py also reads only when sliced.
+        """
+        from os.path import isfile
+        from numpy import memmap
+
+        offset = dataset.id.get_offset()
+        if offset is None or not isfile(dataset.file.filename):
+            return dataset
+
+        return memmap(dataset.file.filename, dataset.dtype, "r", offset, dataset.shape)
+
+    mo.show_code()
+    return contextmanager, field, open_results
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## H. `register_microstructure()`
+
+        This is a helper function to store a microstructure file only if its contents are new. The file is identified by the SHA-256 digest of its contents, computed in chunks so that large files are never read into memory at once. The path, size, and modification time of every file registered with the same contents are recorded alongside the digest, so that an unchanged file is found again without being read at all, from whichever of these paths. Microstructures stored before digests were recorded are given theirs the first time a new file is looked up, so they are found as well.
+        """
+    )
+    return
+
+
+@app.cell
+def register_microstructure_helper(Path, QueryBuilder, SinglefileData, mo):
+    def register_microstructure(path, label="microstructure"):
+        """Helper function to return the microstructure node stored for a file.
+
+        The file is only stored if no microstructure with the same SHA-256 digest
+        exists yet. Microstructures stored without a recorded digest are given
+        one first. The path, size, and modification time of the file are added
+        to the `sources` extra of the node. Returns the new or existing
+        `SinglefileData` node.
+        """
+        from hashlib import sha256
+
+        def digest(handle):
+            """Return the SHA-256 digest of a binary file, read in chunks."""
+            hasher = sha256()
+            for chunk in iter(lambda: handle.read(2**20), b""):
+                hasher.update(chunk)
+            return hasher.hexdigest()
+
+        path = Path(path).resolve()
+        stat = path.stat()
+        source = {"path": str(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+        microstructurefile = QueryBuilder().append(
+            SinglefileData, filters={
+                SinglefileData.fields.label: label,
+                "extras.sources": {"contains": [source]}
+            }
+        ).first(flat=True)
+        if microstructurefile is not None:  # the file is unchanged since it was registered
+            return microstructurefile
+
+        for node in QueryBuilder().append(            # stored before digests were recorded
+            SinglefileData, filters={
+                SinglefileData.fields.label: label,
+                "extras": {"!has_key": "sha256"}
+            }
+        ).all(flat=True):
+            with node.open(mode="rb") as handle:
+                node.base.extras.set("sha256", digest(handle))
+
+        with path.open("rb") as handle:
+            contents = digest(handle)
+
+        microstructurefile = QueryBuilder().append(
+            SinglefileData, filters={
+                SinglefileData.fields.label: label,
+                "extras.sha256": contents
+            }
+        ).first(flat=True)
+        if microstructurefile is None:
+            microstructurefile = SinglefileData(path, label=label).store()
+
+        sources = [other for other in microstructurefile.base.extras.get("sources", []) if other["path"] != source["path"]]
+        microstructurefile.base.extras.set_many({"sha256": contents, "sources": sources + [source]})
+        return microstructurefile
+
+    mo.show_code()
+    return (register_microstructure,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## I. `parameter_space()`
+
+        This is a helper function to sample a parameter space. Each parameter is given as a range, or a list of ranges for properties with a value per phase, and a fixed number of samples is drawn from the whole space by Latin hypercube, Sobol, or grid sampling. A grid has the same number of levels for every parameter, so its size is rounded up to the next full grid, with a warning. The samples are generated lazily, in blocks, so that even a very large design never has to be held in memory at once.
+        """
+    )
+    return
+
+
+@app.cell
+def parameter_space_helper(mo):
+    def parameter_space(ranges, n, method="lhs", seed=None, block=1024):
+        """Helper function to yield `n` samples of a parameter space.
+
+        The `ranges` map each parameter to a `(low, high)` range, or to a list of
+        such ranges, and every sample is a dictionary of the same shape. The
+        `method` is one of "lhs", "sobol", or "grid". Latin hypercube samples are
+        drawn in blocks of `block` points, each of which is itself a Latin
+        hypercube. A grid uses the fewest levels per parameter that give at least
+        `n` points, and yields all of them, with a warning if there are more.
+        """
+        import warnings
+        from itertools import islice, product
+        from math import ceil
+        from numpy import linspace
+        from scipy.stats import qmc
+
+        leaves = [
+            (key, index, bounds)
+            for key, value in ranges.items()
+            for index, bounds in (enumerate(value) if isinstance(value, list) else [(None, value)])
+        ]
+        low, high = zip(*(bounds for _, _, bounds in leaves))
+
+        def unflatten(point):
+            sample = {key: [] if isinstance(value, list) else None for key, value in ranges.items()}
+            for (key, index, _), x in zip(leaves, point):
+                if index is None:
+                    sample[key] = float(x)
+                else:
+                    sample[key].append(float(x))
+            return sample
+
+        match method:
+            case "grid":
+                levels = max(1, ceil(n ** (1 / len(leaves)) - 1e-9))
+                if levels ** len(leaves) != n:
+                    warnings.warn(
+                        f"A grid of {levels} levels per parameter has {levels ** len(leaves)} points, not {n}.",
+                        stacklevel=2,
+                    )
+                n = levels ** len(leaves)
+                points = product(*(linspace(lo, hi, levels) for lo, hi in zip(low, high)))
+            case "lhs" | "sobol":
+                sampler = (qmc.LatinHypercube if method == "lhs" else qmc.Sobol)(d=len(leaves), seed=seed)
+                points = (
+                    point
+                    for start in range(0, n, block)
+                    for point in qmc.scale(
+                        sampler.random(block if method == "sobol" else min(block, n - start)), low, high
+                    )
+                )
+            case _:
+                raise NotImplementedError
+
+        for point in islice(points, n):
+            yield unflatten(point)
+
+    mo.show_code()
+    return (parameter_space,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    adaptive_button = mo.ui.run_button(label="RUN")
+
+    mo.md(
+        rf"""
+        ## J. `adaptive_sweep()`
+
+        This is a helper function to run a parameter space study adaptively, rather than fixing every sample beforehand. After an initial batch, each new batch of `material_properties` is picked where the effective stresses of neighbouring calculations differ most, relative to how far apart they are. The study stops once the effective stresses can be interpolated between the calculations to within a tolerance, or once the budget of calculations is spent. Run it below, once the parameters of [Executing Calculations](#executing-calculations) are defined, to study the same space as the sweep there.
+
+        ```py
+        calcs, error = adaptive_sweep(
+            FANSCalculation,
+            some_params[0] | n_it_params[0] | code | resources,
+            {{"bulk_modulus": [(50, 75), (200, 250)], "shear_modulus": [(25, 50), (150, 200)]}},
+            batch_size=8, budget=64, tolerance=0.01, mpiprocs=mpiprocs,
+        )
+        ```
+
+        {adaptive_button}
+        """
+    )
+    return (adaptive_button,)
+
+
+@app.cell
+def adaptive_sweep_helper(Dict, mo, parameter_space, parse_log, store_unique, sweep):
+    def adaptive_sweep(process_class, inputs, ranges, batch_size, budget, tolerance=0.01, seed=None, **options):
+        """Helper function to sample `material_properties` adaptively.
+
+        Every batch of `batch_size` samples is run with the other `inputs` through
+        `sweep()`, which is passed any further `options`. The samples are picked
+        from a pool of Sobol points over the `ranges`. The study stops when the
+        leave-one-out error of interpolating the effective stresses, relative to
+        their magnitude, is at most `tolerance`, or after `budget` calculations.
+
+        Returns the successfully finished calculations and the final error.
+        """
+        from numpy import array, concatenate, inf, maximum, minimum
+        from numpy.linalg import norm
+
+        bounds = [b for value in ranges.values() for b in (value if isinstance(value, list) else [value])]
+        low, high = array(bounds).T
+
+        def position(sample):
+            """Return the position of a sample in the unit hypercube."""
+            point = [x for key in ranges for x in (sample[key] if isinstance(sample[key], list) else [sample[key]])]
+            return (array(point) - low) / (high - low)
+
+        def neighbours(points, positions, k):
+            """Return the distances to and indices of the `k` nearest positions."""
+            distances = norm(points[:, None, :] - positions[None, :, :], axis=-1)
+            nearest = distances.argsort(axis=1)[:, :k]
+            return distances, nearest
+
+        def error(positions, responses):
+            """Return the largest leave-one-out error of inverse distance weighting."""
+            if len(positions) < 2:
+                return inf
+            distances, nearest = neighbours(positions, positions, min(len(positions), len(bounds) + 2))
+            errors = []
+            for i, (row, others) in enumerate(zip(distances, nearest)):
+                others = others[others != i]
+                weights = 1 / maximum(row[others], 1e-9) ** 2  # coincident positions all but decide the value
+                prediction = weights @ responses[others] / weights.sum()
+                errors.append(norm(prediction - responses[i]) / norm(responses[i]))
+            return max(errors)
+
+        def pick(candidates, positions, responses, n):
+            """Return the indices of the `n` most informative candidates."""
+            distances, nearest = neighbours(candidates, positions, min(len(positions), len(bounds) + 1))
+            variation = norm(responses[nearest].std(axis=1), axis=-1) / norm(responses, axis=-1).mean()
+            closest = distances.min(axis=1)
+            chosen = []
+            for _ in range(min(n, len(candidates))):
+                best = int((closest * (variation + 1e-12)).argmax())
+                chosen.append(best)
+                closest = minimum(closest, norm(candidates - candidates[best], axis=-1))
+                closest[chosen] = 0
+            return chosen
+
+        pool = list(parameter_space(ranges, n=max(1024, 16 * budget), method="sobol", seed=seed))
+        candidates = array([position(sample) for sample in pool])
+        batch = list(range(min(batch_size, budget)))
+
+        calcs, positions, responses, submitted, estimate = [], [], [], 0, inf
+        while batch:
+            properties, _ = store_unique([Dict(pool[i], label="material_properties") for i in batch])
+            jobs = sweep(
+                process_class,
+                (inputs | {"material_properties": mp} for mp in properties),
+                **options
+            ).wait()
+            submitted += len(batch)
+
+            for calc in jobs.finished:
+                calcs.append(calc)
+                positions.append(position(calc.inputs.material_properties.get_dict()))
+                responses.append(concatenate([case["stress"][-1] for case in parse_log(calc.outputs.retrieved)]))
+
+            pool = [sample for i, sample in enumerate(pool) if i not in batch]
+            candidates = candidates[[i for i in range(len(candidates)) if i not in batch]]
+            estimate = error(array(positions), array(responses))
+            if estimate <= tolerance or submitted >= budget or not positions:
+                break
+            batch = pick(candidates, array(positions), array(responses), min(batch_size, budget - submitted))
+
+        return calcs, estimate
+
+    mo.show_code()
+    return (adaptive_sweep,)
+
+
+@app.cell(hide_code=True)
+def _(
+    adaptive_button,
+    adaptive_sweep,
+    averages_calculation,
+    code_settings,
+    load_code,
+    mo,
+    n_it_params,
+    some_params,
+    tuned_mpiprocs,
+):
+    mo.stop(not adaptive_button.value)  # run on click
+
+    try:
+        _code = {"code": load_code(code_settings.value["label"])}
+    except Exception:
+        mo.stop(True, output=mo.md("**Your code failed to load properly!**\n\nPlease submit the 'Define a Code' form in the [AiiDA Setup](aiida-setup) section.").style(text_align="center").callout(kind="danger"))
+    _mpiprocs = (
+        tuned_mpiprocs(some_params[0]["microstructure"])
+        or _code["code"].computer.get_default_mpiprocs_per_machine()
+        or 1
+    )
+    _resources = {"metadata": {"options": {
+        "resources": {"num_machines": 1, "num_mpiprocs_per_machine": _mpiprocs},
+    }}}
+
+    _calcs, _error = adaptive_sweep(
+        averages_calculation(),
+        some_params[0] | n_it_params[0] | _code | _resources,
+        {"bulk_modulus": [(50, 75), (200, 250)], "shear_modulus": [(25, 50), (150, 200)]},
+        batch_size=8, budget=64, tolerance=0.01, mpiprocs=_mpiprocs,
+    )
+    mo.md(
+        f"**{len(_calcs)}** calculations finished, after which the effective stresses are interpolated "
+        f"to within **{_error:.2%}**."
+    ).callout(kind="success" if _error <= 0.01 else "warn")
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## K. `packed_calculation()`, `pack()`, and `members()`
+
+        When each FANS run only takes seconds, starting a scheduler job, initialising MPI, and staging the microstructure can cost more than the solve itself. This calculation job runs FANS for several parameter sets, one after another, within a single job. The microstructure is staged only once, and, as by the plugin, only its dataset is copied. Each parameter set is a "member" of the job, with its own `material_properties` and `n_it` inputs, labelled `material_properties__<key>` and `n_it__<key>`, its own log, `<key>.json.log`, and its own `results` output, so the provenance of every parameter set is kept. Like `AveragesFANSCalculation` (see [Appendix P](#appendix)), the calculation job and its parser are defined in the `fans_tutorial` package, registered as the `fans_tutorial.packed` entry points, so that packed jobs are reused from the cache too. The `pack()` helper groups parameter sets that share all their other inputs into the inputs of such jobs, and the `members()` helper counts the parameter sets run by a job, one for a job which isn't packed.
+        """
+    )
+    return
+
+
+@app.cell
+def packing_helper(mo):
+    from functools import cache
+
+    @cache
+    def packed_calculation():
+        """Helper function to return the `PackedFANSCalculation` process class.
+
+        The class is only loaded on first use, so that the AiiDA engine is not
+        imported before a packed job is actually run.
+        """
+        from aiida.plugins import CalculationFactory
+
+        return CalculationFactory("fans_tutorial.packed")
+
+    def members(calc):
+        """Helper function to return the number of parameter sets run by a calculation."""
+        return len(calc.base.links.get_incoming(link_label_filter="n_it%").all())
+
+    def pack(parameter_sets, size):
+        """Helper function to pack parameter sets into `PackedFANSCalculation` inputs.
+
+        Consecutive parameter sets which differ only in `material_properties` and
+        `n_it` are grouped into jobs of up to `size` members each. The parameter
+        sets are consumed lazily.
+        """
+        def shared(parameters):
+            return {k: v for k, v in parameters.items() if k not in ("material_properties", "n_it")}
+
+        def packed(batch):
+            return shared(batch[0]) | {
+                "material_properties": {f"m{i}": p["material_properties"] for i, p in enumerate(batch)},
+                "n_it": {f"m{i}": p["n_it"] for i, p in enumerate(batch)},
+            }
+
+        batch = []
+        for parameters in parameter_sets:
+            if batch and (len(batch) == size or shared(parameters) != shared(batch[0])):
+                yield packed(batch)
+                batch = []
+            batch.append(parameters)
+        if batch:
+            yield packed(batch)
+
+    mo.show_code()
+    return cache, members, pack, packed_calculation
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    autotune_button = mo.ui.run_button(label="CALIBRATE")
+
+    mo.md(
+        rf"""
+        ## L. `autotune()` and `tuned_mpiprocs()`
+
+        The best number of MPI processes for FANS depends on the size of the microstructure: a small grid gains little from many processes, while a large grid needs them. These helper functions run a few short calibration solves with different numbers of processes and record the wall time and parallel efficiency of each. The largest number of processes which is still used efficiently is recorded on the microstructure file for its dataset, and used for later calculations.
+
+        ```py
+        mpiprocs, calibration = autotune(
+            FANSCalculation,
+            some_params[0] | next(material_properties_params()) | code,  # a full parameter set
+        )
+        ```
+
+        Calibrate below, once the parameters of [Executing Calculations](#executing-calculations) are defined, and the sweep there will use the recorded number of processes.
+
+        {autotune_button}
+        """
+    )
+    return (autotune_button,)
+
+
+@app.cell
+def autotune_helper(mo, sweep):
+    def autotune(process_class, inputs, counts=None, n_it=10, threshold=0.7):
+        """Helper function to find the best number of MPI processes for a microstructure.
+
+        A calibration solve of `n_it` iterations is run with each of the process
+        `counts` in turn, by default every power of two up to the available cores.
+        The largest count whose parallel efficiency, relative to the smallest count,
+        is at least `threshold` is recorded on the microstructure file for its
+        dataset. Returns that count, and the wall time and efficiency of each count.
+        Counts whose solve failed are reported in a warning and left out, and if
+        every solve failed, nothing is recorded and the count returned is `None`.
+        """
+        import warnings
+        from os import sched_getaffinity
+        from aiida.orm import Int
+
+        if counts is None:
+            cores = len(sched_getaffinity(0))
+            counts = [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+
+        times, failed = {}, {}
+        for count in counts:
+            jobs = sweep(process_class, [inputs | {
+                "n_it": Int(n_it),
+                "metadata": {"options": {
+                    "resources": {"num_machines": 1, "num_mpiprocs_per_machine": count},
+                    "prepend_text": "autotune_start=$(date +%s.%N)",
+                    "append_text": 'echo "$autotune_start $(date +%s.%N)" > autotune.time',
+                    "additional_retrieve_list": ["autotune.time"],
+                }},
+            }], max_concurrent=1, use_cache=False).wait()
+            for calc in jobs.finished + jobs.failed:  # kept out of the results and the cache
+                calc.base.extras.set("autotune", count)
+                calc.base.caching.is_valid_cache = False
+            for calc in jobs.finished:
+                start, end = calc.outputs.retrieved.base.repository.get_object_content("autotune.time").split()
+                times[count] = float(end) - float(start)
+            for calc in jobs.failed:
+                failed[count] = calc.pk
+
+        if failed:
+            warnings.warn(
+                "The calibration solves failed with "
+                + ", ".join(f"{count} processes (pk {pk})" for count, pk in failed.items()) + ".",
+                stacklevel=2,
+            )
+        if not times:
+            return None, {}
+
+        base = min(times)
+        calibration = {
+            str(count): {"wall_time": time, "efficiency": base * times[base] / (count * time)}
+            for count, time in times.items()
+        }
+        mpiprocs = max(int(count) for count, record in calibration.items() if record["efficiency"] >= threshold)
+
+        microstructure = inputs["microstructure"]
+        datasetname = microstructure["datasetname"].value
+        for key, value in (("mpiprocs", mpiprocs), ("calibration", calibration)):
+            microstructure["file"].base.extras.set(
+                key, microstructure["file"].base.extras.get(key, {}) | {datasetname: value}
+            )
+
+        return mpiprocs, calibration
+
+    def tuned_mpiprocs(microstructure):
+        """Helper function to return the recorded number of MPI processes, if any."""
+        return microstructure["file"].base.extras.get("mpiprocs", {}).get(microstructure["datasetname"].value)
+
+    mo.show_code()
+    return autotune, tuned_mpiprocs
+
+
+@app.cell(hide_code=True)
+def calibration(
+    autotune,
+    autotune_button,
+    averages_calculation,
+    code_settings,
+    load_code,
+    material_properties_params,
+    mo,
+    some_params,
+):
+    mo.stop(not autotune_button.value)  # run on click
+
+    try:
+        _code = {"code": load_code(code_settings.value["label"])}
+    except Exception:
+        mo.stop(True, output=mo.md("**Your code failed to load properly!**\n\nPlease submit the 'Define a Code' form in the [AiiDA Setup](aiida-setup) section.").style(text_align="center").callout(kind="danger"))
+    if (_material_properties := next(material_properties_params(), None)) is None:
+        mo.stop(True, output=mo.md("**There are no `material_properties` to calibrate with!**\n\nPlease store the nodes of [Creating Input Parameters](#creating-input-parameters) first.").callout(kind="warn"))
+
+    calibrated_mpiprocs, calibration_records = autotune(
+        averages_calculation(), some_params[0] | _material_properties | _code,
+    )
+    mo.md(
+        f"The calibration recorded **{calibrated_mpiprocs}** MPI processes for the microstructure, with "
+        + ", ".join(f"{count}: {record['efficiency']:.0%}" for count, record in calibration_records.items())
+        + " parallel efficiency."
+        if calibrated_mpiprocs is not None else "**Every calibration solve failed**, so nothing was recorded."
+    ).callout(kind="success" if calibrated_mpiprocs is not None else "danger")
+    return calibrated_mpiprocs, calibration_records
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## M. `monitor()`
+
+        This is a helper function to follow a sweep while it runs. It drives the sweep just like iterating over it, and meanwhile keeps the output of the running cell up to date with the number of completed, running, and failed jobs, the throughput, the average wall time per job, and the estimated time remaining. The logs of the running jobs are tailed from their working directories, reading only what was appended since the last refresh, and the residual of every iteration is plotted, so stalled or slowly converging jobs stand out long before the sweep is over.
+
+        ```py
+        for job in monitor(sweep(FANSCalculation, parameter_sets), total=len(parameter_sets)):
+            print(job.pk)
+        ```
+        """
+    )
+    return
+
+
+@app.cell
+def monitor_helper(mo):
+    def _tail(node, logs):
+        """Read the lines appended to the logs of a running job since the last call.
+
+        Only what was appended is read: in place for jobs run on this machine,
+        and with `tail` on the computer otherwise.
+        """
+        from pathlib import PurePosixPath
+        from re import compile
+        from shlex import quote
+
+        iteration = compile(r"^it\s+\d+\s.*?err\s+(\S+?),?\s")
+
+        workdir = node.get_remote_workdir()
+        if workdir is None:
+            return
+        local = node.computer.transport_type == "core.local"
+        with node.get_transport() as transport:
+            if not transport.isdir(workdir):
+                return
+            for filename in transport.listdir(workdir, pattern="*.log"):
+                path = str(PurePosixPath(workdir) / filename)
+                offset, residuals = logs.setdefault((node.pk, filename), (0, []))
+                if local:
+                    with open(path, "rb") as handle:
+                        handle.seek(offset)
+                        tail = handle.read()
+                else:
+                    retval, tail, _ = transport.exec_command_wait_bytes(f"tail -c +{offset + 1} {quote(path)}")
+                    if retval:
+                        continue
+                complete = tail[:tail.rfind(b"\n") + 1]       # leave a partly written line for later
+                for line in complete.decode("utf-8", errors="replace").splitlines():
+                    if match := iteration.match(line):
+                        residuals.append(float(match.group(1)))
+                logs[(node.pk, filename)] = (offset + len(complete), residuals)
+
+    def _plot(series, width=640, height=240):
+        """Plot the residuals of each series against their iteration on a log scale."""
+        from math import log10
+
+        series = {label: [log10(r) for r in residuals if r > 0] for label, residuals in series.items()}
+        series = {label: points for label, points in series.items() if points}
+        if not series:
+            return mo.md("*No residuals have been reported by the running jobs yet.*")
+
+        n = max(len(points) for points in series.values())
+        low = min(min(points) for points in series.values())
+        high = max(max(points) for points in series.values())
+        span = (high - low) or 1.0
+
+        lines = []
+        for i, (label, points) in enumerate(series.items()):
+            xy = " ".join(
+                f"{width * j / max(1, n - 1):.1f},{height * (high - y) / span:.1f}" for j, y in enumerate(points)
+            )
+            lines.append(
+                f'<polyline points="{xy}" fill="none" stroke="hsl({i * 137 % 360}, 60%, 45%)" '
+                f'stroke-width="1.5"><title>{label}</title></polyline>'
+            )
+        return mo.Html(
+            f'<svg viewBox="-60 -10 {width + 70} {height + 40}" width="{width + 70}" style="font-size: 12px">'
+            f'<text x="-8" y="4" text-anchor="end">1e{high:.0f}</text>'
+            f'<text x="-8" y="{height + 4}" text-anchor="end">1e{low:.0f}</text>'
+            f'<text x="{width / 2}" y="{height + 25}" text-anchor="middle">iteration</text>'
+            f'<rect width="{width}" height="{height}" fill="none" stroke="#ccc"/>'
+            + "".join(lines)
+            + "</svg>"
+        )
+
+    def monitor(jobs, total=None, interval=5.0):
+        """Helper function to run a sweep while showing its progress live.
+
+        Yields each job as it terminates, just like iterating over the sweep. At
+        least every `interval` seconds, the output of the running cell is replaced
+        by the job counts, throughput, average wall time per job and, if the `total`
+        number of jobs is given, the estimated time remaining, along with a plot
+        of the residuals tailed from the logs of the running jobs.
+        """
+        from datetime import timedelta
+        from time import monotonic
+
+        start = refreshed = monotonic()
+        wall_times, logs = [], {}
+
+        for node in jobs.watch(interval):
+            if node is not None and not node.base.caching.is_created_from_cache:
+                wall_times.append((node.mtime - node.ctime).total_seconds())
+            if node is not None and monotonic() - refreshed < interval:
+                yield node
+                continue
+            refreshed = monotonic()
+
+            running = {job.pk: job for job in jobs.running}
+            for key in [key for key in logs if key[0] not in running]:
+                del logs[key]
+            for job in running.values():
+                _tail(job, logs)
+
+            completed = len(jobs.finished) + len(jobs.failed)
+            elapsed = refreshed - start
+            rate = completed / elapsed if completed else 0.0
+            eta = (
+                str(timedelta(seconds=round((total - completed) / rate)))
+                if total is not None and rate else "unknown"
+            )
+            mo.output.replace(mo.vstack([
+                mo.hstack([
+                    mo.stat(len(jobs.finished), label="completed", caption=f"of {total}" if total else None, bordered=True),
+                    mo.stat(len(running), label="running", bordered=True),
+                    mo.stat(len(jobs.failed), label="failed", bordered=True),
+                    mo.stat(f"{60 * rate:.1f}", label="jobs per minute", bordered=True),
+                    mo.stat(
+                        f"{sum(wall_times) / len(wall_times):.1f} s" if wall_times else "-",
+                        label="wall time per job", bordered=True,
+                    ),
+                    mo.stat(eta, label="time remaining", bordered=True),
+                ]),
+                _plot({
+                    f"{running[pk].process_label}<{pk}> {filename}": residuals
+                    for (pk, filename), (_, residuals) in logs.items()
+                }),
+            ]))
+            if node is not None:
+                yield node
+
+    mo.show_code()
+    return (monitor,)
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    import_times_button = mo.ui.run_button(label="RUN")
+
+    mo.md(
+        rf"""
+        ## N. `import_times()`
+
+        This is a helper function to measure how long it takes to import each of the modules this notebook relies on. The modules are imported one after another in a fresh Python interpreter with the `-X importtime` option, so the modules this notebook has already imported don't skew the result. Each module is charged with everything it imports that an earlier module hasn't imported already.
+
+        {import_times_button}
+        """
+    )
+    return (import_times_button,)
+
+
+@app.cell
+def import_times_helper(mo):
+    def import_times(modules=(
+        "numpy", "aiida", "aiida.orm", "aiida.plugins", "aiida.engine", "aiida_fans", "h5py", "scipy.stats.qmc",
+    )):
+        """Helper function to measure the time to import each module in seconds.
+
+        The modules are imported in the given order, in a separate interpreter.
+        """
+        import sys
+        from subprocess import run
+
+        marker = "import time: --"
+        script = "; ".join(f"import {module}; sys.stderr.write('{marker}\\n')" for module in modules)
+        result = run(
+            [sys.executable, "-X", "importtime", "-c", "import sys; " + script],
+            capture_output=True, text=True, check=True,
+        )
+
+        times, total = [], 0
+        for line in result.stderr.splitlines():
+            if line == marker:
+                times.append(total / 1e6)
+                total = 0
+            elif line.startswith("import time:") and line.count("|") == 2:
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit() and not name.startswith("  "):  # top level imports only
+                    total += int(cumulative)
+
+        return dict(zip(modules, times))
+
+    mo.show_code()
+    return (import_times,)
+
+
+@app.cell(hide_code=True)
+def _(import_times, import_times_button, mo):
+    mo.stop(not import_times_button.value)  # run on click
+
+    _times = import_times()
+    mo.ui.table(
+        [{"module": module, "seconds": round(seconds, 3)} for module, seconds in _times.items()]
+        + [{"module": "total", "seconds": round(sum(_times.values()), 3)}],
+        selection=None,
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    storage_benchmark_button = mo.ui.run_button(label="RUN")
+
+    mo.md(
+        rf"""
+        ## O. `tune_storage()` and `storage_benchmark()`
+
+        A SQLite profile lets only one process write to its database at a time. By default, the whole database is also locked while it is written, and a process that finds it locked fails after a few seconds. The first helper function switches the database to write-ahead logging, with which readers and the writer no longer block each other, and lets every connection wait for a lock for much longer. It is called whenever this notebook loads a profile, and leaves other storage backends as they are.
+
+        The second helper function measures how many nodes per second the loaded profile can store, one by one and in a single transaction, and how many queries per second it answers. The nodes it stores are deleted again afterwards. Run it to compare backends, or to see whether your profile will keep up with a large sweep.
+
+        {storage_benchmark_button}
+        """
+    )
+    return (storage_benchmark_button,)
+
+
+@app.cell
+def storage_helper(mo):
+    _tuned = set()  # ids of the engines tuned so far
+
+    def tune_storage(busy_timeout=60.0):
+        """Helper function to tune a SQLite profile for concurrent use.
+
+        The database is switched to write-ahead logging, which persists in the
+        database file, and every connection waits up to `busy_timeout` seconds for
+        a lock. Other storage backends are left as they are. Returns the storage.
+        """
+        from aiida.manage import get_manager
+        from sqlalchemy import event
+
+        storage = get_manager().get_profile_storage()
+        if storage.profile.storage_backend != "core.sqlite_dos":
+            return storage
+
+        engine = storage.get_session().get_bind()
+        if id(engine) in _tuned:
+            return storage
+
+        def pragmas(connection, _):
+            cursor = connection.cursor()
+            cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+            cursor.execute("PRAGMA synchronous = NORMAL")  # safe with write-ahead logging
+            cursor.close()
+
+        event.listen(engine, "connect", pragmas)
+        storage.get_session().close()
+        engine.dispose()  # reconnect with the pragmas above
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode = WAL")
+        _tuned.add(id(engine))
+
+        return storage
+
+    def storage_benchmark(n=1000):
+        """Helper function to measure the node store and query throughput of the profile.
+
+        Stores `n` nodes one by one and `n` nodes in a single transaction, then
+        queries them by attribute value and through a group. Returns the backend
+        and the operations per second of each step.
+        """
+        from time import perf_counter
+        from aiida.manage import get_manager
+        from aiida.orm import Group, Int, QueryBuilder
+        from aiida.tools import delete_nodes
+
+        storage = get_manager().get_profile_storage()
+        label = f"storage_benchmark_{perf_counter()}"
+        results = {"backend": storage.profile.storage_backend}
+
+        start = perf_counter()
+        nodes = [Int(i, label=label).store() for i in range(n)]
+        results["stored one by one"] = n / (perf_counter() - start)
+
+        start = perf_counter()
+        with storage.transaction():
+            nodes += [Int(i, label=label).store() for i in range(n)]
+        results["stored in one transaction"] = n / (perf_counter() - start)
+
+        group = Group(label=label).store()
+        group.add_nodes(nodes)
+        try:
+            values = range(0, n, max(1, n // 100))
+            start = perf_counter()
+            for value in values:
+                QueryBuilder().append(Int, filters={"label": label, "attributes.value": value}).all()
+            results["queries by value"] = len(values) / (perf_counter() - start)
+
+            start = perf_counter()
+            QueryBuilder().append(Group, filters={"label": label}, tag="group").append(
+                Int, with_group="group", project="id"
+            ).all()
+            results["rows through a group"] = len(nodes) / (perf_counter() - start)
+        finally:
+            Group.collection.delete(group.pk)
+            delete_nodes([node.pk for node in nodes], dry_run=False)
+
+        return results
+
+    mo.show_code()
+    return storage_benchmark, tune_storage
+
+
+@app.cell(hide_code=True)
+def _(mo, storage_benchmark, storage_benchmark_button):
+    mo.stop(not storage_benchmark_button.value)  # run on click
+
+    _results = storage_benchmark()
+    mo.ui.table(
+        [{"step": step, "per second": round(rate)} for step, rate in _results.items() if step != "backend"],
+        selection=None,
+        label=f"Throughput of the {_results['backend']} storage of this profile",
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## P. `averages_calculation()`, `fetch_fields()`, `expire_fields()`, `compact_results()`, and `clean_workdir()`
+
+        FANS writes every requested result to its HDF5 file, including fields with a value for every voxel, such as `stress`, `strain`, and `displacement`. These fields make up nearly all of the file, and are rarely looked at. So, by default, the `results` output only keeps the scalar and averaged results. The fields can be left in the working directory of the job on the computer, and are then only copied into the repository when an analysis asks for them. Set the `retrieve_fields` option of a job to store them right away instead.
+
+        The first helper function returns a variant of the plugin's `FANSCalculation` following this policy, while `PackedFANSCalculation` (see [Appendix K](#appendix)) follows it of itself. Its parser drops the fields from the results before storing them as the plugin's parser does. Both are defined in the `fans_tutorial` package next to this notebook, and registered as the `fans_tutorial.averages` entry points when the requirements are installed, so that AiiDA can load them again later. Without this, AiiDA couldn't tell whether a finished calculation may be reused from its cache. The second helper function fetches the full results of a calculation from its working directory, on first use only. The copy is made by a calcfunction, so its provenance is kept. The third helper function deletes the working directories of jobs older than a retention window, after which their fields can no longer be fetched. It is called before every sweep, unless you turn it off, and deletes each directory through the transport of its computer with the last helper function.
+
+        FANS writes its fields uncompressed in double precision, and every job also writes out a copy of the microstructure it was given. Whenever full fields are stored, whether right away or fetched later, they are first compacted by the fourth helper function. The fields are split into chunks of one plane of voxels each and compressed, and the microstructure is replaced by attributes referring to the input file it came from. With the `field_tolerance` option, fields are also stored in single precision, as long as no value changes by more than this fraction of the largest value. In its `bytes_saved` extra, each job records how much smaller its stored results are than those FANS wrote. The helper function can also be called on any results file by itself.
+        """
+    )
+    return
+
+
+@app.cell
+def fields_helper(mo):
+    import functools
+    from fans_tutorial.results import FIELDS, compact_results  # results with a value per voxel
+
+    @functools.cache
+    def averages_calculation():
+        """Helper function to return the `AveragesFANSCalculation` process class.
+
+        The class is only loaded on first use, so that the AiiDA engine is not
+        imported before a job is actually run.
+        """
+        from aiida.plugins import CalculationFactory
+
+        return CalculationFactory("fans_tutorial.averages")
+
+    def fetch_fields(calc, key=None):
+        """Helper function to return the full HDF5 results of a calculation.
+
+        Returns a `SinglefileData`. Unless the fields were stored with the job,
+        they are copied from its working directory on the first call, and the
+        same node is returned by later calls. For a `PackedFANSCalculation`,
+        `key` selects the member.
+        """
+        from aiida.orm import CalcFunctionNode, Str
+
+        results = calc.outputs.results if key is None else calc.outputs.results[key]
+        if calc.get_option("retrieve_fields"):
+            return results
+
+        filename = results.filename
+        remote_folder = calc.outputs.remote_folder
+        for node in remote_folder.base.links.get_outgoing(node_class=CalcFunctionNode).all_nodes():
+            if node.process_label == "copy_results" and node.is_finished_ok \
+                    and node.inputs.filename.value == filename:
+                return node.outputs.result
+
+        if remote_folder.is_cleaned:
+            raise FileNotFoundError(
+                f"The fields of {calc.process_label}<{calc.pk}> were not kept, or have expired. "
+                "Run it again with its fields kept, or with the `retrieve_fields` option to store them."
+            )
+        from fans_tutorial.calculations import copy_results
+
+        return copy_results(remote_folder, Str(filename))
+
+    def expire_fields(days=7.0):
+        """Helper function to delete the working directories of old FANS jobs.
+
+        The working directories of successful jobs created more than `days` ago
+        are emptied. Returns the number of directories emptied.
+        """
+        from datetime import datetime, timedelta, timezone
+        from aiida.orm import CalcJobNode, QueryBuilder, RemoteData
+
+        expired = QueryBuilder().append(
+            CalcJobNode, tag="calc",
+            filters={
+                "attributes.exit_status": 0,
+                "attributes.process_label": {"in": ["AveragesFANSCalculation", "PackedFANSCalculation"]},
+                "ctime": {"<": datetime.now(timezone.utc) - timedelta(days=days)},
+            },
+        ).append(
+            RemoteData, with_incoming="calc", project="*",
+            edge_filters={"label": "remote_folder"},
+            filters={"extras": {"!has_key": RemoteData.KEY_EXTRA_CLEANED}},
+        ).all(flat=True)
+
+        for remote_folder in expired:
+            clean_workdir(remote_folder)
+        return len(expired)
+
+    def clean_workdir(remote_folder):
+        """Helper function to delete the working directory of a job on its computer.
+
+        The directory is deleted through the transport of the computer, and the
+        `remote_folder` is marked as cleaned, so that its `is_cleaned` is true.
+        """
+        from aiida.orm import RemoteData
+
+        with remote_folder.get_authinfo().get_transport() as transport:
+            path = remote_folder.get_remote_path()
+            if transport.path_exists(path):
+                transport.rmtree(path)
+        remote_folder.base.extras.set(RemoteData.KEY_EXTRA_CLEANED, True)
+
+    mo.show_code()
+    return (
+        FIELDS,
+        averages_calculation,
+        clean_workdir,
+        compact_results,
+        expire_fields,
+        fetch_fields,
+        functools,
+    )
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    index_button = mo.ui.run_button(label="CREATE INDEXES")
+    explain_button = mo.ui.run_button(label="RUN")
+
+    mo.md(
+        rf"""
+        ## Q. `ensure_indexes()` and `explain()`
+
+        `fetch()` looks up nodes by their label and the `value` or `list` in their attributes, which the database stores as JSON. AiiDA indexes the label, but not the attributes, so every lookup reads the attributes of every node with the label, which gets slower as the profile grows. On PostgreSQL, the first helper function creates GIN indexes on the `value` and `list` in the attributes, which `fetch()` queries by containment there. On SQLite, the `QueryBuilder` wraps its comparisons of the attributes in checks of their JSON type, which no index can serve, so nothing is created and the label index does all the work. As these indexes are added to a table owned by AiiDA, they are only created when you ask for it below, and those which already exist are left alone. On PostgreSQL, they are built concurrently, so other processes can keep writing to the profile meanwhile. The statistics the query planner relies on are refreshed whenever a new index is created.
+
+        {index_button}
+
+        The second helper function shows the plan by which the database runs the query of a `QueryBuilder`, so you can see whether it uses an index or scans the whole table. Run it below for the queries of `fetch()` and `parameter_definition`.
+
+        {explain_button}
+        """
+    )
+    return explain_button, index_button
+
+
+@app.cell
+def indexes_helper(mo):
+    _INDEXES = {
+        "core.psql_dos": {
+            "ix_fans_value": "db_dbnode USING gin ((attributes #> '{value}') jsonb_path_ops)",
+            "ix_fans_list": "db_dbnode USING gin ((attributes #> '{list}') jsonb_path_ops)",
+        },
+    }
+
+    def ensure_indexes(drop=False):
+        """Helper function to create the indexes used by `fetch()` if they are missing.
+
+        Only PostgreSQL profiles are given indexes, and other storage backends are
+        left as they are. With `drop`, the indexes are removed instead, for example
+        before migrating the storage. Returns the names of the indexes created or
+        dropped.
+        """
+        from aiida.manage import get_manager
+
+        storage = get_manager().get_profile_storage()
+        indexes = _INDEXES.get(storage.profile.storage_backend, {})
+        if not indexes:
+            return []
+
+        # each statement commits by itself, as PostgreSQL builds indexes concurrently only outside a transaction
+        engine = storage.get_session().get_bind()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            existing = {name for (name,) in connection.exec_driver_sql(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'db_dbnode'"
+            )}
+
+            if drop:
+                changed = sorted(existing & indexes.keys())
+                for name in changed:
+                    connection.exec_driver_sql(f"DROP INDEX CONCURRENTLY {name}")
+            else:
+                changed = sorted(indexes.keys() - existing)
+                for name in changed:  # without blocking writes to the table
+                    connection.exec_driver_sql(f"CREATE INDEX CONCURRENTLY {name} ON {indexes[name]}")
+                if changed:
+                    connection.exec_driver_sql("ANALYZE db_dbnode")  # let the planner know of them
+
+        return changed
+
+    def explain(qb):
+        """Helper function to return the plan by which the database runs a query.
+
+        The plan is given as text, with one step per line. On SQLite, it is the
+        output of `EXPLAIN QUERY PLAN`, and on PostgreSQL, that of `EXPLAIN`.
+        """
+        from aiida.manage import get_manager
+
+        storage = get_manager().get_profile_storage()
+        prefix = "EXPLAIN QUERY PLAN" if storage.profile.storage_backend == "core.sqlite_dos" else "EXPLAIN"
+        with storage.get_session().get_bind().connect() as connection:
+            cursor = connection.connection.cursor()  # unlike SQLAlchemy, leaves the % in LIKE patterns alone
+            cursor.execute(f"{prefix} {qb.as_sql(inline=True)}")
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    mo.show_code()
+    return ensure_indexes, explain
+
+
+@app.cell(hide_code=True)
+def _(ensure_indexes, index_button, mo):
+    mo.stop(not index_button.value)  # run on click
+
+    _created = ensure_indexes()
+    mo.md(
+        f"Created the indexes **{'**, **'.join(_created)}**." if _created else "No indexes are missing on this storage backend."
+    ).callout(kind="success")
+    return
+
+
+@app.cell(hide_code=True)
+def _(Dict, QueryBuilder, SinglefileData, explain, explain_button, fetch, mo):
+    mo.stop(not explain_button.value)  # run on click
+
+    _queries = {
+        "fetch('n_it', 100)": fetch.query("n_it", 100),
+        "fetch('ms_L', [1.0, 1.0, 1.0])": fetch.query("ms_L", [1.0, 1.0, 1.0]),
+        "material_properties": QueryBuilder().append(Dict, filters={"label": "material_properties"}),
+        "microstructure": QueryBuilder().append(SinglefileData, filters={"label": "microstructure"}),
+    }
+    mo.ui.table(
+        [{"query": _name, "plan": explain(_qb)} for _name, _qb in _queries.items()],
+        selection=None,
+    )
+    return
+
+
+@app.cell(hide_code=True)
+def _(mo):
+    mo.md(
+        r"""
+        ## R. `filter_calcs()`
+
+        This is a helper function to select calculations by conditions on several of their inputs at once. Each keyword names an input by its link label, such as `n_it` or `error_parameters__tolerance`, and is given the value it must have, a tuple `(low, high)` of bounds, either of which may be `None`, or a dictionary of `QueryBuilder` operators. For a `Dict` like `material_properties`, a dictionary of conditions on its keys is given instead, where the elements of a list are addressed by their index, such as `bulk_modulus.0`. Every condition is compiled into a single `QueryBuilder` with one join per input, so the filtering is done by the database however many calculations there are. Note that jobs running several parameter sets (see [Appendix K](#appendix)) label their inputs per set, so they are only selected by the inputs they share. SQLite cannot address the elements of a list in the attributes, so there, those conditions are checked in Python instead, on the rows as they are streamed from the database.
+        """
+    )
+    return
+
+
+@app.cell
+def filter_helper(CalcJobNode, Data, QueryBuilder, mo):
+    def _condition(condition):
+        """Return the `QueryBuilder` filter of a single condition."""
+        match condition:
+            case dict():
+                return condition
+            case tuple((low, high)):
+                bounds = [{operator: bound} for operator, bound in ((">=", low), ("<=", high)) if bound is not None]
+                return bounds[0] if len(bounds) == 1 else {"and": bounds}
+            case _:
+                return {"==": condition}
+
+    def _matches(value, filters):
+        """Return whether a value satisfies a `QueryBuilder` filter, evaluated in Python."""
+        import operator
+
+        compare = {
+            "==": operator.eq, "!==": operator.ne, ">": operator.gt, ">=": operator.ge,
+            "<": operator.lt, "<=": operator.le, "in": lambda a, b: a in b, "!in": lambda a, b: a not in b,
+        }
+
+        def check(filters):
+            for name, bound in filters.items():
+                match name:
+                    case "and":
+                        matched = all(map(check, bound))
+                    case "or":
+                        matched = any(map(check, bound))
+                    case _ if name in compare:
+                        matched = value is not None and compare[name](value, bound)
+                    case _:
+                        raise NotImplementedError(f"The operator `{name}` cannot be evaluated in Python.")
+                if not matched:
+                    return False
+            return True
+
+        return check(filters)
+
+    def _element(attributes, key):
+        """Return the element of the attributes at a dotted key, or `None` if it is missing."""
+        for part in key.split("."):
+            try:
+                attributes = attributes[int(part) if isinstance(attributes, list) else part]
+            except (IndexError, KeyError, TypeError, ValueError):
+                return None
+        return attributes
+
+    class _Filtered:
+        """Rows of a query, of which the conditions SQLite cannot compile are checked in Python."""
+
+        def __init__(self, qb, width, conditions):
+            self.qb = qb
+            self._width = width
+            self._conditions = conditions
+
+        def iterall(self, batch_size=100):
+            """Stream the rows satisfying every condition, in batches of `batch_size`."""
+            for row in self.qb.iterall(batch_size=batch_size):
+                if all(
+                    _matches(_element(attributes, key), filters)
+                    for attributes, conditions in zip(row[self._width:], self._conditions)
+                    for key, filters in conditions.items()
+                ):
+                    yield row[:self._width]
+
+        def all(self, batch_size=100):
+            """Return the rows satisfying every condition."""
+            return list(self.iterall(batch_size))
+
+    def filter_calcs(project=("id", "uuid"), **conditions):
+        """Helper function to select calculations by conditions on their inputs.
+
+        Each keyword is the link label of an input, given the condition on its
+        `value`, or on its `list`, or for a `Dict` a dictionary of conditions on
+        its keys. A condition is a value, a tuple of `(low, high)` bounds, or a
+        dictionary of `QueryBuilder` operators.
+
+        Returns a `QueryBuilder` projecting `project` of the calculations, with
+        one join per input, to be streamed with `iterall(batch_size=...)`. As
+        SQLite cannot address the elements of a list, conditions on them are
+        checked in Python there instead, on the streamed rows of a query with
+        the same `iterall()` and `all()`. On SQLite, the default backend, this
+        includes every condition on the per-phase moduli, such as
+        `bulk_modulus.0`, so all the rows matching the other conditions are read.
+        """
+        from aiida.manage import get_manager
+
+        sqlite = get_manager().get_profile_storage().profile.storage_backend != "core.psql_dos"
+        qb = QueryBuilder().append(CalcJobNode, tag="calc", project=list(project))
+        deferred = []                                 # conditions on list elements, per input projecting its attributes
+        for label, bounds in conditions.items():
+            if not isinstance(bounds, dict):
+                path = "list" if isinstance(bounds, list) else "value"
+                bounds = {path: bounds}
+            filters, elements = {}, {}
+            for key, condition in bounds.items():
+                if sqlite and any(part.isdigit() for part in key.split(".")):
+                    elements[key] = _condition(condition)
+                else:
+                    filters[f"attributes.{key}"] = _condition(condition)
+            qb.append(
+                Data, with_outgoing="calc", filters=filters,
+                edge_filters={"label": label}, project=["attributes"] if elements else [],
+            )
+            if elements:
+                deferred.append(elements)
+        return _Filtered(qb, len(project), deferred) if deferred else qb
+
+    mo.show_code()
+    return (filter_calcs,)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--headless" in sys.argv:                      # run without the UI, see headless.py
+        from headless import main
+
+        sys.exit(main(sys.argv[1:]))
     app.run()